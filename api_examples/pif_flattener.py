@@ -0,0 +1,263 @@
+'''
+This file contains a schema-inferring flattener that turns PIF systems into table columns. A column plan (property and condition name -> column, dtype and units) is inferred from a sample of systems and cached per dataset ID. The plan then decodes the remaining systems into preallocated NumPy columns: systems laid out like the sample are read positionally, and only systems with a different layout fall back to a lookup by name. Properties and conditions that the sample did not contain widen the plan with new columns instead of being dropped.
+'''
+
+from collections import Counter, OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+# A table column: the property and condition names it is read from (cond is
+# None for the property itself) and whether it holds the first scalar value
+# or the units
+Column = namedtuple("Column", "name, prop, cond, field, dtype, units")
+
+# System attributes copied into every table
+SYSTEM_COLUMNS = ("uid", "names", "chemical_formula")
+
+_plans = {}
+
+
+def _first_value(scalars):
+    if isinstance(scalars, list):
+        scalars = scalars[0] if scalars else None
+    return getattr(scalars, "value", scalars)
+
+
+def _is_number(value):
+    if value is None:
+        return True
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _layout(system):
+    return tuple(
+        (prop.name, tuple(cond.name for cond in (prop.conditions or [])))
+        for prop in (system.properties or [])
+    )
+
+
+def _column_name(prop_name, cond_name, field):
+    if field == "units":
+        return "Units {}".format(prop_name)
+    if cond_name is None:
+        return "Property {}".format(prop_name)
+    return "{} | Condition {}".format(prop_name, cond_name)
+
+
+class ColumnPlan(object):
+    '''Column layout of the PIF systems of a dataset
+
+    Each property becomes a ``Property <name>`` column, followed by a
+    ``Units <name>`` column when it has units, and each of its conditions a
+    ``<name> | Condition <condition>`` column. Columns whose sampled values
+    all parse as numbers are float columns, others hold objects.
+
+    :param columns: Columns of the table after the system columns
+    :type columns: List[Column]
+    :param layout: Property and condition names of a typical system, in order
+    :type layout: Tuple[Tuple[str, Tuple[str, ...]], ...]
+    '''
+
+    def __init__(self, columns, layout):
+        self.columns = list(columns)
+        self.layout = layout
+        self.added = []
+        self.retyped = []
+        self._by_key = {(column.prop, column.cond, column.field): i for i, column in enumerate(self.columns)}
+
+        # Positions of the plan's columns in a system laid out like the plan
+        self._positions = {}
+        for i, (prop_name, cond_names) in enumerate(layout):
+            self._positions[(prop_name, None)] = (i, None)
+            for j, cond_name in enumerate(cond_names):
+                self._positions[(prop_name, cond_name)] = (i, j)
+        self._slots = [(k,) + self._positions[(column.prop, column.cond)] + (column.field,)
+                       for k, column in enumerate(self.columns) if (column.prop, column.cond) in self._positions]
+        self._unitless = [i for i, (prop_name, _) in enumerate(layout)
+                          if (prop_name, None, "units") not in self._by_key]
+
+    @classmethod
+    def infer(cls, systems):
+        '''Infers a plan from a sample of systems
+
+        :param systems: Sample of PIF systems
+        :type systems: List[System]
+        :return: The inferred plan
+        :rtype: ColumnPlan
+        '''
+
+        layouts = Counter(_layout(system) for system in systems)
+        layout = list(layouts.most_common(1)[0][0]) if layouts else []
+
+        # Properties or conditions seen only outside the common layout are appended to it
+        positions = {name: i for i, (name, _) in enumerate(layout)}
+        for system in systems:
+            for prop in system.properties or []:
+                cond_names = tuple(cond.name for cond in (prop.conditions or []))
+                if prop.name not in positions:
+                    positions[prop.name] = len(layout)
+                    layout.append((prop.name, cond_names))
+                else:
+                    i = positions[prop.name]
+                    known = layout[i][1]
+                    extra = tuple(name for name in cond_names if name not in known)
+                    if extra:
+                        layout[i] = (prop.name, known + extra)
+        layout = tuple(layout)
+
+        numeric, units = {}, {}
+        for system in systems:
+            for prop in system.properties or []:
+                key = (prop.name, None)
+                numeric[key] = numeric.get(key, True) and _is_number(_first_value(prop.scalars))
+                units[key] = units.get(key) or getattr(prop, "units", None)
+                for cond in prop.conditions or []:
+                    key = (prop.name, cond.name)
+                    numeric[key] = numeric.get(key, True) and _is_number(_first_value(cond.scalars))
+                    units[key] = units.get(key) or getattr(cond, "units", None)
+
+        columns = []
+        for prop_name, cond_names in layout:
+            for cond_name in (None,) + cond_names:
+                key = (prop_name, cond_name)
+                columns.append(Column(_column_name(prop_name, cond_name, "value"), prop_name, cond_name, "value",
+                                      float if numeric.get(key, True) else object, units.get(key)))
+                if cond_name is None and units.get(key):
+                    columns.append(Column(_column_name(prop_name, None, "units"), prop_name, None, "units",
+                                          object, None))
+        return cls(columns, layout)
+
+    @property
+    def column_names(self):
+        return list(SYSTEM_COLUMNS) + [column.name for column in self.columns]
+
+    @property
+    def units(self):
+        return OrderedDict((column.name, column.units) for column in self.columns if column.units)
+
+    def decode(self, systems):
+        '''Decodes systems into a table with the columns of the plan
+
+        Properties and conditions absent from the plan are added to it as
+        new columns, listed in ``added``. Float columns that meet a value that
+        is not a number become object columns, listed in ``retyped``.
+
+        :param systems: PIF systems to decode
+        :type systems: List[System]
+        :return: One row per system
+        :rtype: pd.DataFrame
+        '''
+
+        n = len(systems)
+        system_arrays = [np.empty(n, dtype=object) for _ in SYSTEM_COLUMNS]
+        arrays = [np.full(n, np.nan) if column.dtype is float else np.full(n, None, dtype=object)
+                  for column in self.columns]
+
+        for row, system in enumerate(systems):
+            names = system.names
+            system_arrays[0][row] = system.uid
+            system_arrays[1][row] = "; ".join(names) if isinstance(names, list) else names
+            system_arrays[2][row] = getattr(system, "chemical_formula", None)
+
+            props = system.properties or []
+            if _layout(system) == self.layout:
+                # Fast path: the system is laid out like the plan
+                for k, prop, cond, field in self._slots:
+                    source = props[prop] if cond is None else props[prop].conditions[cond]
+                    if field == "units":
+                        arrays[k][row] = source.units
+                    else:
+                        self._store(arrays, k, row, _first_value(source.scalars))
+                for prop in self._unitless:
+                    if getattr(props[prop], "units", None):
+                        self._set(arrays, n, (props[prop].name, None, "units"), row, props[prop].units)
+                continue
+
+            for prop in props:
+                self._set(arrays, n, (prop.name, None, "value"), row, _first_value(prop.scalars))
+                if getattr(prop, "units", None):
+                    self._set(arrays, n, (prop.name, None, "units"), row, prop.units)
+                for cond in prop.conditions or []:
+                    self._set(arrays, n, (prop.name, cond.name, "value"), row, _first_value(cond.scalars))
+
+        data = OrderedDict(zip(SYSTEM_COLUMNS, system_arrays))
+        data.update((column.name, array) for column, array in zip(self.columns, arrays))
+        return pd.DataFrame(data, columns=self.column_names)
+
+    def _set(self, arrays, n, key, row, value):
+        k = self._by_key.get(key)
+        if k is None:
+            k = self._add(key, value)
+            column = self.columns[k]
+            arrays.append(np.full(n, np.nan) if column.dtype is float else np.full(n, None, dtype=object))
+        self._store(arrays, k, row, value)
+
+    def _add(self, key, value):
+        prop_name, cond_name, field = key
+        dtype = float if field == "value" and _is_number(value) else object
+        column = Column(_column_name(prop_name, cond_name, field), prop_name, cond_name, field, dtype, None)
+        self.columns.append(column)
+        self.added.append(column.name)
+        k = self._by_key[key] = len(self.columns) - 1
+        if (prop_name, cond_name) in self._positions:
+            # A units column of a property in the layout is read positionally from now on
+            self._slots.append((k,) + self._positions[(prop_name, cond_name)] + (field,))
+            self._unitless = [i for i in self._unitless if self.layout[i][0] != prop_name]
+        return k
+
+    def _store(self, arrays, k, row, value):
+        if arrays[k].dtype != object:
+            try:
+                arrays[k][row] = np.nan if value is None else float(value)
+                return
+            except (TypeError, ValueError):
+                # A value that is not a number turns the float column into an object column
+                arrays[k] = np.array([None if np.isnan(x) else x for x in arrays[k]], dtype=object)
+                self.columns[k] = self.columns[k]._replace(dtype=object)
+                self.retyped.append(self.columns[k].name)
+        arrays[k][row] = value
+
+
+def plan_for_dataset(dataset_id, systems, refresh = False):
+    '''Returns the cached column plan of a dataset, inferring it from a sample the first time
+
+    :param dataset_id: Dataset ID the plan is cached under
+    :type dataset_id: int
+    :param systems: Sample of the dataset's PIF systems
+    :type systems: List[System]
+    :param refresh: Infer the plan again even if one is cached, defaults to False
+    :type refresh: bool, optional
+    :return: The column plan of the dataset
+    :rtype: ColumnPlan
+    '''
+
+    key = str(dataset_id)
+    if refresh or key not in _plans:
+        _plans[key] = ColumnPlan.infer(systems)
+    return _plans[key]
+
+
+def flatten_hits(hits, dataset_id = None, sample_size = 100):
+    '''Flattens PIF search hits into a table
+
+    :param hits: Search hits whose systems are flattened
+    :type hits: List[PifSearchHit]
+    :param dataset_id: Dataset ID to cache the plan under, defaults to None (do not cache)
+    :type dataset_id: int, optional
+    :param sample_size: Systems the plan is inferred from, defaults to 100
+    :type sample_size: int, optional
+    :return: One row per hit
+    :rtype: pd.DataFrame
+    '''
+
+    systems = [hit.system for hit in hits]
+    if dataset_id is None:
+        plan = ColumnPlan.infer(systems[:sample_size])
+    else:
+        plan = plan_for_dataset(dataset_id, systems[:sample_size])
+    return plan.decode(systems)
@@ -0,0 +1,217 @@
+'''
+This file contains a paginated, streaming exporter from the PyCC search client to CSV or Parquet. Pages of a PifSystemReturningQuery are fetched concurrently ahead of the page being written, hits are flattened into columns with pif_flattener, and the columns are written page by page, so memory stays bounded by a few pages regardless of the size of the result set.
+'''
+
+import copy
+import csv
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pif_flattener import ColumnPlan, plan_for_dataset
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Citrination does not page past this many results of one query
+MAX_RESULTS = 50000
+
+
+def iter_pif_pages(client, query, page_size = 1000, prefetch = 2):
+    '''Pages through the hits of a PIF query, fetching the next pages while the current one is used
+
+    :param client: Client object
+    :type client: CitrinationClient
+    :param query: Query whose ``from_index`` and ``size`` are replaced for each page
+    :type query: PifSystemReturningQuery
+    :param page_size: Hits requested per page, defaults to 1000
+    :type page_size: int, optional
+    :param prefetch: Pages requested ahead of the page being consumed, defaults to 2
+    :type prefetch: int, optional
+    :return: Generator of lists of hits, in order
+    :rtype: Iterator[List[PifSearchHit]]
+    '''
+
+    def fetch(from_index):
+        page_query = copy.deepcopy(query)
+        page_query.from_index = from_index
+        page_query.size = page_size
+        return client.search.pif_search(page_query)
+
+    first = fetch(0)
+    total = min(first.total_num_hits, MAX_RESULTS)
+    if first.total_num_hits > MAX_RESULTS:
+        print("Query matches {} PIFs; only the first {} can be paged through.".format(
+            first.total_num_hits, MAX_RESULTS))
+    with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+        pending = deque()
+        next_index = page_size
+
+        def top_up():
+            nonlocal next_index
+            while next_index < total and len(pending) < max(prefetch, 1):
+                pending.append(executor.submit(fetch, next_index))
+                next_index += page_size
+
+        # The next pages are requested before the current one is handed out
+        top_up()
+        if first.hits:
+            yield first.hits
+        while pending:
+            hits = pending.popleft().result().hits
+            if not hits:
+                break
+            top_up()
+            yield hits
+
+
+class _CSVFrameWriter(object):
+    '''Writes frames to a CSV file, widening the header when later frames bring new columns'''
+
+    def __init__(self, filepath, columns, widen = True):
+        self.filepath = filepath
+        self.columns = list(columns)
+        self.widen = widen
+        self._width = len(self.columns)
+        self._handle = open(filepath, "w", newline="")
+        self._header = True
+
+    def write(self, frame):
+        if self.widen:
+            self.columns += [column for column in frame.columns if column not in self.columns]
+        frame.reindex(columns=self.columns).to_csv(self._handle, header=self._header, index=False)
+        if self._header:
+            self._width = len(self.columns)
+        self._header = False
+
+    def close(self):
+        self._handle.close()
+        if len(self.columns) > self._width:
+            # Rewrite the header and pad the rows written before the new columns appeared
+            temporary = self.filepath + ".tmp"
+            with open(self.filepath, newline="") as source, open(temporary, "w", newline="") as target:
+                reader, writer = csv.reader(source), csv.writer(target)
+                next(reader)
+                writer.writerow(self.columns)
+                for row in reader:
+                    writer.writerow(row + [""] * (len(self.columns) - len(row)))
+            os.replace(temporary, self.filepath)
+
+
+class _ParquetFrameWriter(object):
+    '''Writes frames to a Parquet file, merging the parts written before and after its schema changed'''
+
+    def __init__(self, filepath, columns, widen = True):
+        if pa is None:
+            raise ImportError("pyarrow is required to write Parquet files")
+        self.filepath = filepath
+        self.columns = list(columns)
+        self.widen = widen
+        self.schema = None
+        self._writer = None
+        self._parts = []
+
+    def write(self, frame):
+        if self.widen:
+            self.columns += [column for column in frame.columns if column not in self.columns]
+        frame = frame.reindex(columns=self.columns)
+        for column in frame.columns:
+            if frame[column].dtype == object:
+                frame[column] = [None if value is None else str(value) for value in frame[column]]
+        # The schema of a part is fixed by its first page; new columns, and
+        # float columns that now hold text, start a new part
+        types = OrderedDict((field.name, field.type) for field in self.schema or [])
+        for column in self.columns:
+            if frame[column].dtype.kind != "f":
+                types[column] = pa.string()
+            elif column not in types:
+                types[column] = pa.float64()
+        schema = pa.schema(list(types.items()))
+        if self.schema is None or not schema.equals(self.schema):
+            self.schema = schema
+            if self._writer is not None:
+                self._writer.close()
+            self._parts.append("{}.part{}".format(self.filepath, len(self._parts)))
+            self._writer = pq.ParquetWriter(self._parts[-1], self.schema)
+        self._writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        if len(self._parts) == 1:
+            os.replace(self._parts[0], self.filepath)
+            return
+        with pq.ParquetWriter(self.filepath, self.schema) as writer:
+            for part in self._parts:
+                for batch in pq.ParquetFile(part).iter_batches():
+                    arrays = [batch.column(field.name).cast(field.type) if field.name in batch.schema.names
+                              else pa.nulls(len(batch), field.type) for field in self.schema]
+                    writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+                os.remove(part)
+
+
+def export_pif_search(client, query, filepath, output_format = "csv", columns = None,
+                      page_size = 1000, prefetch = 2, dataset_id = None, print_output = False):
+    '''Streams the flattened hits of a PIF query to a CSV or Parquet file
+
+    The column plan of ``pif_flattener`` is inferred from the first page, or
+    reused from the cache when ``dataset_id`` is given, and every page is
+    decoded with it and written before the next one is used. Properties that
+    first appear on a later page widen the plan and are added as columns of
+    the file, unless ``columns`` fixes them.
+
+    :param client: Client object
+    :type client: CitrinationClient
+    :param query: Query to export
+    :type query: PifSystemReturningQuery
+    :param filepath: Output file path
+    :type filepath: str
+    :param output_format: "csv" or "parquet", defaults to "csv"
+    :type output_format: str, optional
+    :param columns: Columns to write, defaults to None (all columns of the plan)
+    :type columns: List[str], optional
+    :param page_size: Hits requested per page, defaults to 1000
+    :type page_size: int, optional
+    :param prefetch: Pages requested ahead of the page being written, defaults to 2
+    :type prefetch: int, optional
+    :param dataset_id: Dataset ID the column plan is cached under, defaults to None (do not cache)
+    :type dataset_id: int, optional
+    :param print_output: Whether or not to print progress
+    :type print_output: bool, optional
+    :return: Number of rows written
+    :rtype: int
+    '''
+
+    if output_format not in ("csv", "parquet"):
+        raise ValueError("Unsupported output format: {}".format(output_format))
+
+    writer = None
+    plan = None
+    count = 0
+    try:
+        for hits in iter_pif_pages(client, query, page_size, prefetch):
+            systems = [hit.system for hit in hits]
+            if plan is None:
+                if dataset_id is None:
+                    plan = ColumnPlan.infer(systems)
+                else:
+                    plan = plan_for_dataset(dataset_id, systems)
+                writer_class = _CSVFrameWriter if output_format == "csv" else _ParquetFrameWriter
+                writer = writer_class(filepath, columns or plan.column_names, widen=columns is None)
+            writer.write(plan.decode(systems))
+            count += len(systems)
+            if print_output:
+                print("Exported {} PIFs to {}".format(count, filepath))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if print_output and plan is not None and plan.added:
+        print("Columns added after the first page: {}".format(", ".join(plan.added)))
+    if print_output and plan is not None and plan.retyped:
+        print("Columns holding text after the first page: {}".format(", ".join(plan.retyped)))
+    return count
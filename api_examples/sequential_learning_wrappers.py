@@ -3,9 +3,12 @@ Authors: Eddie Kim, Enze Chen
 This file contains wrapper functions that are used in the sequential learning API tutorial notebook. Detailed docstrings with method fuctions and parameters are given below.
 '''
 
+import asyncio
 import json
+import threading
 from collections import OrderedDict
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -17,21 +20,34 @@ from citrination_client.views.data_view_builder import DataViewBuilder
 from pypif import pif
 from pypif.obj import *
 
+from pif_flattener import plan_for_dataset
 
-def write_dataset_from_func(test_function, filename, input_vals):
+
+def write_dataset_from_func(test_function, filename, input_vals, vectorized = False):
     '''Given a function, write a dataset evaluated on given input values
 
+    With ``vectorized=True`` the function is called once on the whole
+    (n_rows, n_inputs) array and must return the n_rows outputs; the PIFs
+    are then streamed to disk as compact JSON without building System
+    objects. The records match what ``pif.dumps`` writes for the same values.
+
     :param test_function: Function for generating dataset
     :type test_function: Callable[[np.ndarray], float]
     :param filename: Name of file for saving CSV dataset
     :type filename: str
     :param input_vals: List of input values to eval function over
     :type input_vals: np.ndarray
-    :return: Doesn't return anything
-    :rtype: None
+    :param vectorized: Evaluate all rows in one call and stream compact JSON, defaults to False
+    :type vectorized: bool, optional
+    :return: Function value of each input row, in order
+    :rtype: List[float]
     '''
 
+    if vectorized:
+        return _write_dataset_vectorized(test_function, filename, input_vals)
+
     pif_systems = []
+    y_vals = []
     for i, val_row in enumerate(input_vals):
         system = System()
         system.names = '{}_{}'.format(test_function.__name__, i)
@@ -48,9 +64,75 @@ def write_dataset_from_func(test_function, filename, input_vals):
         func_output.scalars = test_function(val_row)
         system.properties.append(func_output)
         pif_systems.append(system)
+        y_vals.append(float(func_output.scalars))
 
     with open(filename, "w") as f:
         f.write(pif.dumps(pif_systems, indent=4))
+    return y_vals
+
+
+def _write_dataset_vectorized(test_function, filename, input_vals):
+    x_vals = np.atleast_2d(np.asarray(input_vals, dtype=float))
+    y_vals = np.asarray(test_function(x_vals), dtype=float).ravel()
+    if len(y_vals) != len(x_vals):
+        raise ValueError("{} returned {} values for {} rows".format(
+            test_function.__name__, len(y_vals), len(x_vals)))
+
+    # Every record shares one layout, so it is formatted from a template
+    input_keys = ['{{"name":"x{}","scalars":'.format(j+1) for j in range(x_vals.shape[1])]
+    template = '{{"names":{},"properties":[{},{{"name":"y","scalars":{}}}],"category":"system"}}'
+
+    with open(filename, "w") as f:
+        f.write("[")
+        for i, (x_row, y_val) in enumerate(zip(x_vals.tolist(), y_vals.tolist())):
+            inputs = ",".join(key + json.dumps(x_val) + "}" for key, x_val in zip(input_keys, x_row))
+            name = json.dumps("{}_{}".format(test_function.__name__, i))
+            f.write(("," if i else "") + template.format(name, inputs, json.dumps(y_val)))
+        f.write("]")
+    return y_vals.tolist()
+
+
+def query_measured_values(client, dataset_id, page_size = 1000, output_name = "y"):
+    '''Pages through a dataset and returns the measured output of every PIF
+
+    The output is the property named ``output_name``, "y" as written by
+    ``write_dataset_from_func``. PIFs without a numeric value of it are
+    skipped.
+
+    :param client: Client object
+    :type client: CitrinationClient
+    :param dataset_id: Dataset ID
+    :type dataset_id: int
+    :param page_size: PIFs requested per search, defaults to 1000
+    :type page_size: int, optional
+    :param output_name: Name of the output property, defaults to "y"
+    :type output_name: str, optional
+    :return: Measured output values
+    :rtype: List[float]
+    :raises ValueError: If no PIF of the dataset has a value of the output
+    '''
+
+    y_vals = []
+    from_index = 0
+    while True:
+        query_dataset = PifSystemReturningQuery(from_index=from_index, size=page_size,
+                            query=DataQuery(
+                            dataset=DatasetQuery(
+                                id=Filter(equal=str(dataset_id))
+                        )))
+        query_result = client.search.pif_search(query_dataset)
+        systems = [hit.system for hit in query_result.hits]
+        if systems:
+            frame = plan_for_dataset(dataset_id, systems).decode(systems)
+            output_column = "Property {}".format(output_name)
+            if output_column in frame:
+                y_vals.extend(frame[output_column].dropna().astype(float).tolist())
+        from_index += len(query_result.hits)
+        if not query_result.hits or from_index >= query_result.total_num_hits:
+            if from_index and not y_vals:
+                raise ValueError("No PIF of dataset {} has a value of property {}".format(
+                    dataset_id, output_name))
+            return y_vals
 
 
 def upload_data_and_get_id(client, dataset_name, dataset_local_fpath,
@@ -85,7 +167,7 @@ def upload_data_and_get_id(client, dataset_name, dataset_local_fpath,
 
 
 def build_view_and_get_id(client, dataset_id, input_keys, output_keys, view_name, view_desc = "",
-                        wait_time = 2, print_output = False):
+                        wait_time = 2, print_output = False, timeout = None):
     '''Builds a new data view and returns the view ID
 
     :param client: Client object
@@ -100,10 +182,12 @@ def build_view_and_get_id(client, dataset_id, input_keys, output_keys, view_name
     :type output_keys: List[str]
     :param view_desc: Description for the view, defaults to ""
     :param view_desc: str, optional
-    :param wait_time: Wait time in seconds before polling API
+    :param wait_time: Longest interval in seconds between two status checks
     :type wait_time: int
     :param print_output: Whether or not to print outputs
     :type print_output: bool
+    :param timeout: Seconds to wait on ingestion, defaults to None (wait forever)
+    :type timeout: float, optional
     :return: ID of the view
     :rtype: int
     '''
@@ -122,7 +206,7 @@ def build_view_and_get_id(client, dataset_id, input_keys, output_keys, view_name
 
     dv_config = dv_builder.build()
 
-    _wait_on_ingest(client, dataset_id, wait_time, print_output)
+    _wait_on_ingest(client, dataset_id, wait_time, print_output, timeout)
 
     dv_id = client.data_views.create(
         configuration=dv_config,
@@ -138,10 +222,12 @@ def run_sequential_learning(client, view_id, dataset_id,
                         num_sl_iterations, input_properties,
                         target, print_output,
                         true_function,
-                        score_type):
+                        score_type, timeout = None,
+                        initial_best = None, reconcile = False, page_size = 1000,
+                        vectorized = False, backend = None):
     '''Runs SL design
 
-    :param client: Client object
+    :param client: Client object, unused when a backend is given
     :type client: CitrinationClient
     :param view_id: View ID
     :type view_id: int
@@ -151,7 +237,7 @@ def run_sequential_learning(client, view_id, dataset_id,
     :type num_candidates_per_iter: int
     :param design_effort: Effort from 1-30
     :type design_effort: int
-    :param wait_time: Wait time in seconds before polling API
+    :param wait_time: Longest interval in seconds between two status checks
     :type wait_time: int
     :param num_sl_iterations: SL iterations to run
     :type num_sl_iterations: int
@@ -165,44 +251,51 @@ def run_sequential_learning(client, view_id, dataset_id,
     :type true_function: Callable[[np.ndarray], float]
     :param score_type: MLI or MEI
     :type score_type: str
+    :param timeout: Seconds to wait on each ingest, view or design run, defaults to None (wait forever)
+    :type timeout: float, optional
+    :param initial_best: Best measured value already in the dataset, defaults to None (query it once)
+    :type initial_best: float, optional
+    :param reconcile: Recompute the best measured value from the whole dataset every iteration, defaults to False
+    :type reconcile: bool, optional
+    :param page_size: PIFs requested per search when querying the dataset, defaults to 1000
+    :type page_size: int, optional
+    :param vectorized: true_function accepts the whole array of candidates, defaults to False
+    :type vectorized: bool, optional
+    :param backend: Where designs are run and data is stored, defaults to None (Citrination through ``client``)
+    :type backend: SequentialLearningBackend, optional
     :return: 2-tuple: list of predicted scores/uncertainties; list of measured scores/uncertainties
     :rtype: Tuple[List[float], List[float]]
     '''
 
-
+    if backend is None:
+        backend = CitrinationBackend(client, view_id, dataset_id, wait_time,
+                                     print_output, timeout)
 
     best_sl_pred_vals = []
     best_sl_measured_vals = []
+    pick_best = min if target[1] == "Min" else max
+    output_name = target[0][len("Property "):] if target[0].startswith("Property ") else target[0]
 
-    _wait_on_ingest(client, dataset_id, wait_time, print_output)
+    backend.wait_for_data()
+
+    # The running best is updated locally from the values written each
+    # iteration, so the dataset is read at most once unless reconciling
+    measured_best = initial_best
+    if measured_best is None and not reconcile:
+        measured_best = pick_best(backend.measured_values(page_size, output_name))
 
     for i in range(num_sl_iterations):
         if print_output:
             print("\n---STARTING SL ITERATION #{}---".format(i+1))
 
-        _wait_on_ingest(client, dataset_id, wait_time, print_output)
-        _wait_on_data_view(client, dataset_id, view_id, wait_time, print_output)
-
-        # Submit a design run
-        design_id = client.models.submit_design_run(
-                data_view_id=view_id,
-                num_candidates=num_candidates_per_iter,
-                effort=design_effort,
-                target=Target(*target),
-                constraints=[],
-                sampler="Default"
-            ).uuid
-
-        if print_output:
-            print("Created design run with ID {}".format(design_id))
-
-        _wait_on_design_run(client, design_id, view_id, wait_time, print_output)
+        backend.wait_for_model()
 
         # Compute the best values with uncertainties as a list of (value, uncertainty)
-        if score_type == "MEI":
-            candidates = client.models.get_design_run_results(view_id, design_id).best_materials
-        else:
-            candidates = client.models.get_design_run_results(view_id, design_id).next_experiments
+        candidates = backend.design(num_candidates_per_iter, design_effort, target, score_type)
+        if not candidates:
+            if print_output:
+                print("No candidates left, stopping after {} SL iterations.".format(i))
+            break
         values_w_uncertainties = [
             (
                 m["descriptor_values"][target[0]],
@@ -227,90 +320,536 @@ def run_sequential_learning(client, view_id, dataset_id,
                 [float(material["descriptor_values"][x]) for x in input_properties]
             ))
 
-        temp_dataset_fpath = "design-{}.json".format(design_id)
-        write_dataset_from_func(true_function, temp_dataset_fpath, new_x_vals)
+        new_y_vals = backend.add_measurements(true_function, new_x_vals, vectorized)
+
+        if print_output:
+            print("Dataset updated: {} candidates added.".format(len(new_x_vals)))
+
+        # Update the best measured value in the dataset
+        if reconcile:
+            dataset_y_values = backend.measured_values(page_size, output_name)
+            if print_output:
+                print("New dataset contains {} PIFs.".format(len(dataset_y_values)))
+            measured_best = pick_best(dataset_y_values)
+        elif new_y_vals:
+            measured_best = pick_best([measured_best] + new_y_vals)
+        best_sl_measured_vals.append(measured_best)
+
+        backend.retrain()
+
+    if print_output:
+        print("SL finished!\n")
+
+    return (best_sl_pred_vals, best_sl_measured_vals)
+
+
+class SequentialLearningBackend(object):
+    '''Interface of the services driven by ``run_sequential_learning``
+
+    A backend owns the dataset and the model of one SL campaign. Candidates
+    returned by ``design`` are dicts shaped like Citrination design results:
+    ``{"descriptor_values": {input: value, ..., output: prediction,
+    "Uncertainty in output": uncertainty}}``.
+    '''
+
+    def wait_for_data(self):
+        '''Blocks until the dataset is ready to be read'''
+
+    def wait_for_model(self):
+        '''Blocks until the data and the model are ready for a design run'''
+
+    def design(self, num_candidates, effort, target, score_type):
+        '''Proposes the next candidates
+
+        :param num_candidates: Candidates in a batch
+        :type num_candidates: int
+        :param effort: Effort from 1-30
+        :type effort: int
+        :param target: ("Output property", {"Min", "Max"})
+        :type target: List[str]
+        :param score_type: MLI or MEI
+        :type score_type: str
+        :return: Candidates with their predicted values and uncertainties, empty when none are left
+        :rtype: List[dict]
+        '''
+        raise NotImplementedError
+
+    def add_measurements(self, true_function, x_vals, vectorized = False):
+        '''Evaluates the candidates and adds them to the dataset
+
+        :param true_function: Actual function for evaluating measured/true values
+        :type true_function: Callable[[np.ndarray], float]
+        :param x_vals: Input values of the candidates
+        :type x_vals: List[np.ndarray]
+        :param vectorized: true_function accepts the whole array of candidates, defaults to False
+        :type vectorized: bool, optional
+        :return: Measured value of each candidate
+        :rtype: List[float]
+        '''
+        raise NotImplementedError
+
+    def measured_values(self, page_size = 1000, output_name = "y"):
+        '''Returns every measured value in the dataset
+
+        :param page_size: Records read per request, defaults to 1000
+        :type page_size: int, optional
+        :param output_name: Name of the output property, defaults to "y"
+        :type output_name: str, optional
+        :return: Measured output values
+        :rtype: List[float]
+        '''
+        raise NotImplementedError
+
+    def retrain(self):
+        '''Retrains the model on the current dataset'''
+        raise NotImplementedError
+
+
+class CitrinationBackend(SequentialLearningBackend):
+    '''Runs designs and stores measurements on Citrination
+
+    :param client: Client object
+    :type client: CitrinationClient
+    :param view_id: View ID
+    :type view_id: int
+    :param dataset_id: Dataset ID
+    :type dataset_id: int
+    :param wait_time: Longest interval in seconds between two status checks
+    :type wait_time: int
+    :param print_output: Whether or not to print outputs
+    :type print_output: bool
+    :param timeout: Seconds to wait on each ingest, view or design run, defaults to None (wait forever)
+    :type timeout: float, optional
+    '''
+
+    def __init__(self, client, view_id, dataset_id, wait_time, print_output, timeout = None):
+        self.client = client
+        self.view_id = view_id
+        self.dataset_id = dataset_id
+        self.wait_time = wait_time
+        self.print_output = print_output
+        self.timeout = timeout
+
+    def wait_for_data(self):
+        _wait_on_ingest(self.client, self.dataset_id, self.wait_time, self.print_output, self.timeout)
+
+    def wait_for_model(self):
+        self.wait_for_data()
+        _wait_on_data_view(self.client, self.dataset_id, self.view_id, self.wait_time,
+                           self.print_output, self.timeout)
+
+    def design(self, num_candidates, effort, target, score_type):
+        # Submit a design run
+        design_id = self.client.models.submit_design_run(
+                data_view_id=self.view_id,
+                num_candidates=num_candidates,
+                effort=effort,
+                target=Target(*target),
+                constraints=[],
+                sampler="Default"
+            ).uuid
+        self.design_id = design_id
+
+        if self.print_output:
+            print("Created design run with ID {}".format(design_id))
+
+        _wait_on_design_run(self.client, design_id, self.view_id, self.wait_time,
+                            self.print_output, self.timeout)
+
+        results = self.client.models.get_design_run_results(self.view_id, design_id)
+        if score_type == "MEI":
+            return results.best_materials
+        return results.next_experiments
+
+    def add_measurements(self, true_function, x_vals, vectorized = False):
+        temp_dataset_fpath = "design-{}.json".format(self.design_id)
+        y_vals = write_dataset_from_func(true_function, temp_dataset_fpath, x_vals,
+                                         vectorized=vectorized)
         upload_data_and_get_id(
-            client,
+            self.client,
             "", # No name needed for updating a dataset
             temp_dataset_fpath,
-            given_dataset_id=dataset_id
+            given_dataset_id=self.dataset_id
         )
+        self.wait_for_data()
+        return y_vals
+
+    def measured_values(self, page_size = 1000, output_name = "y"):
+        return query_measured_values(self.client, self.dataset_id, page_size, output_name)
+
+    def retrain(self):
+        # Retrain model w/ wait times; give the service time to register the
+        # retrain before the view can be reported ready again
+        self.client.models.retrain(self.view_id)
+        _wait_on_data_view(self.client, self.dataset_id, self.view_id, self.wait_time,
+                           self.print_output, self.timeout, settle=self.wait_time)
+
+
+class LocalBackend(SequentialLearningBackend):
+    '''Runs designs in-process with a random forest surrogate
+
+    The surrogate is a forest of scikit-learn regression trees grown on
+    bootstrap samples. Uncertainties come from the bias-corrected
+    jackknife-after-bootstrap estimate of Wager et al. (2014), computed from
+    the recorded in-bag samples. Candidates are drawn from ``candidate_pool``
+    if one is given (chosen rows are removed from it, and fewer or no
+    candidates are proposed once it runs low), otherwise
+    ``samples_per_effort * effort`` points are sampled uniformly within
+    ``bounds``. MEI ranks candidates by predicted value; MLI ranks them by
+    the probability of improving on the best measured value.
+
+    Needs scikit-learn and scipy, which are imported on first use.
+
+    :param x_vals: Input values of the initial dataset
+    :type x_vals: np.ndarray
+    :param y_vals: Measured values of the initial dataset
+    :type y_vals: np.ndarray
+    :param input_properties: Inputs
+    :type input_properties: List[str]
+    :param candidate_pool: Fixed set of candidate inputs, defaults to None
+    :type candidate_pool: np.ndarray, optional
+    :param bounds: (lower, upper) of each input, defaults to None (range of x_vals)
+    :type bounds: List[Tuple[float, float]], optional
+    :param samples_per_effort: Sampled candidates per unit of effort, defaults to 1000
+    :type samples_per_effort: int, optional
+    :param n_estimators: Trees in the forest, defaults to 100
+    :type n_estimators: int, optional
+    :param random_state: Seed of the bootstrap and candidate sampling, defaults to None
+    :type random_state: int, optional
+    '''
 
-        _wait_on_ingest(client, dataset_id, wait_time, print_output)
+    def __init__(self, x_vals, y_vals, input_properties, candidate_pool = None, bounds = None,
+                 samples_per_effort = 1000, n_estimators = 100, random_state = None):
+        self.x_vals = np.atleast_2d(np.asarray(x_vals, dtype=float))
+        self.y_vals = np.asarray(y_vals, dtype=float).ravel()
+        self.input_properties = list(input_properties)
+        self.candidate_pool = None if candidate_pool is None else np.asarray(candidate_pool, dtype=float)
+        if bounds is None:
+            bounds = list(zip(self.x_vals.min(axis=0), self.x_vals.max(axis=0)))
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.samples_per_effort = samples_per_effort
+        self.n_estimators = n_estimators
+        self.rng = np.random.RandomState(random_state)
+        self.trees = []
+        self.in_bag = None
+        self.retrain()
+
+    def retrain(self):
+        from sklearn.tree import DecisionTreeRegressor
+
+        n_samples = len(self.y_vals)
+        self.trees = []
+        self.in_bag = np.zeros((self.n_estimators, n_samples))
+        for b in range(self.n_estimators):
+            sample = self.rng.randint(0, n_samples, n_samples)
+            self.in_bag[b] = np.bincount(sample, minlength=n_samples)
+            tree = DecisionTreeRegressor(max_features=1.0 / 3, min_samples_leaf=1,
+                                         random_state=self.rng.randint(np.iinfo(np.int32).max))
+            self.trees.append(tree.fit(self.x_vals[sample], self.y_vals[sample]))
+
+    def predict(self, x_vals):
+        '''Predicts values and jackknife-after-bootstrap uncertainties
+
+        :param x_vals: Inputs to predict
+        :type x_vals: np.ndarray
+        :return: Predicted values and their standard deviations
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        '''
+
+        tree_preds = np.array([tree.predict(x_vals) for tree in self.trees])
+        mean = tree_preds.mean(axis=0)
+
+        # Mean prediction of the trees that did not see each training point
+        out_of_bag = (self.in_bag == 0).astype(float)
+        counts = out_of_bag.sum(axis=0)
+        seen = counts > 0
+        oob_means = (out_of_bag[:, seen].T @ tree_preds) / counts[seen, None]
+
+        n_trees, n_samples = self.in_bag.shape
+        variance = (n_samples - 1.0) / n_samples * ((oob_means - mean) ** 2).sum(axis=0)
+        variance -= (np.e - 1.0) * n_samples / n_trees * tree_preds.var(axis=0)
+        return mean, np.sqrt(np.clip(variance, 0.0, None))
+
+    def _sample_candidates(self, effort):
+        if self.candidate_pool is not None:
+            return self.candidate_pool
+        lower, upper = self.bounds[:, 0], self.bounds[:, 1]
+        n_samples = max(int(effort), 1) * self.samples_per_effort
+        return lower + (upper - lower) * self.rng.random_sample((n_samples, len(lower)))
+
+    def design(self, num_candidates, effort, target, score_type):
+        from scipy.stats import norm
+
+        pool = self._sample_candidates(effort)
+        num_candidates = min(num_candidates, len(pool))
+        if num_candidates == 0:
+            return []
+        mean, std = self.predict(pool)
+        sign = -1.0 if target[1] == "Min" else 1.0
+        if score_type == "MEI":
+            scores = sign * mean
+        else:
+            best = sign * (sign * self.y_vals).max()
+            scores = norm.cdf(sign * (mean - best) / np.maximum(std, 1e-12))
+        chosen = np.argsort(-scores, kind="stable")[:num_candidates]
+
+        candidates = []
+        for row in chosen:
+            values = dict(zip(self.input_properties, pool[row].tolist()))
+            values[target[0]] = float(mean[row])
+            values["Uncertainty in {}".format(target[0])] = float(std[row])
+            candidates.append({"descriptor_values": values})
+        if self.candidate_pool is not None:
+            self.candidate_pool = np.delete(self.candidate_pool, chosen, axis=0)
+        return candidates
+
+    def add_measurements(self, true_function, x_vals, vectorized = False):
+        x_vals = np.atleast_2d(np.asarray(x_vals, dtype=float))
+        if vectorized:
+            y_vals = np.asarray(true_function(x_vals), dtype=float).ravel()
+        else:
+            y_vals = np.array([true_function(row) for row in x_vals], dtype=float)
+        self.x_vals = np.vstack([self.x_vals, x_vals])
+        self.y_vals = np.concatenate([self.y_vals, y_vals])
+        return y_vals.tolist()
 
-        if print_output:
-            print("Dataset updated: {} candidates added.".format(len(new_x_vals)))
+    def measured_values(self, page_size = 1000, output_name = "y"):
+        return self.y_vals.tolist()
 
-        query_dataset = PifSystemReturningQuery(size=9999,
-                            query=DataQuery(
-                            dataset=DatasetQuery(
-                                id=Filter(equal=str(dataset_id))
-                        )))
-        query_result = client.search.pif_search(query_dataset)
 
-        if print_output:
-            print("New dataset contains {} PIFs.".format(query_result.total_num_hits))
+class BoundedClient(object):
+    '''Wraps a CitrinationClient so that API calls share a bounded budget
 
-        # Update measured values in new dataset
-        dataset_y_values = []
-        for hit in query_result.hits:
-            # Assume last prop is output if following this script
-            dataset_y_values.append(
-                float(hit.system.properties[-1].scalars[0].value)
-            )
+    Every method called on one of the sub-clients (``data``, ``models``,
+    ``data_views``, ``search``, ...) first acquires the shared semaphore, so
+    at most ``budget`` requests are in flight across all the wrappers built
+    on that semaphore. Each wrapper counts its own requests and the seconds
+    they spent queued for the budget.
 
-        if target[1] == "Min":
-            best_sl_measured_vals.append(min(dataset_y_values))
+    :param client: Client object
+    :type client: CitrinationClient
+    :param semaphore: Semaphore shared by every campaign
+    :type semaphore: threading.BoundedSemaphore
+    '''
+
+    def __init__(self, client, semaphore):
+        self._client = client
+        self._semaphore = semaphore
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.queued = 0.0
+
+    def __getattr__(self, name):
+        return _BoundedSubClient(self, getattr(self._client, name))
+
+    def _call(self, method, *args, **kwargs):
+        start = monotonic()
+        with self._semaphore:
+            with self._lock:
+                self.requests += 1
+                self.queued += monotonic() - start
+            return method(*args, **kwargs)
+
+
+class _BoundedSubClient(object):
+
+    def __init__(self, owner, sub_client):
+        self._owner = owner
+        self._sub_client = sub_client
+
+    def __getattr__(self, name):
+        attribute = getattr(self._sub_client, name)
+        if not callable(attribute):
+            return attribute
+
+        def bounded(*args, **kwargs):
+            return self._owner._call(attribute, *args, **kwargs)
+        return bounded
+
+
+def run_campaigns(client, campaigns, max_in_flight = 4, max_concurrent = None):
+    '''Runs several sequential learning campaigns concurrently
+
+    Each campaign is a dict of keyword arguments for
+    ``run_sequential_learning`` (without ``client``) plus a ``name``. As
+    campaigns add their candidates to their dataset and retrain their view,
+    each needs its own dataset and view. The campaigns run in threads and
+    share a budget of ``max_in_flight`` concurrent API requests, so the time
+    one campaign spends waiting on a design run or retrain is used by the
+    others.
+
+    :param client: Client object
+    :type client: CitrinationClient
+    :param campaigns: Keyword arguments of each campaign
+    :type campaigns: List[dict]
+    :param max_in_flight: Largest number of concurrent API requests, defaults to 4
+    :type max_in_flight: int, optional
+    :param max_concurrent: Largest number of concurrent campaigns, defaults to None (all)
+    :type max_concurrent: int, optional
+    :return: One report row per campaign, in the given order, with its results or error and timings
+    :rtype: List[OrderedDict]
+    '''
+
+    semaphore = threading.BoundedSemaphore(max_in_flight)
+
+    def run_one(campaign):
+        campaign = dict(campaign)
+        name = campaign.pop("name", "view {}".format(campaign.get("view_id")))
+        bounded = BoundedClient(client, semaphore)
+        report = OrderedDict(name=name, predicted=None, measured=None, error=None)
+        start = monotonic()
+        try:
+            report["predicted"], report["measured"] = run_sequential_learning(bounded, **campaign)
+        except Exception as exc:
+            report["error"] = repr(exc)
+        report["seconds"] = monotonic() - start
+        report["requests"] = bounded.requests
+        report["queued_seconds"] = bounded.queued
+        return report
+
+    with ThreadPoolExecutor(max_workers=max_concurrent or max(len(campaigns), 1)) as executor:
+        return list(executor.map(run_one, campaigns))
+
+
+def print_campaign_report(reports):
+    '''Prints the best measured value and timings of each campaign
+
+    :param reports: Report rows returned by ``run_campaigns``
+    :type reports: List[OrderedDict]
+    :return: Doesn't return anything
+    :rtype: None
+    '''
+
+    for report in reports:
+        if report["error"] is not None:
+            outcome = "failed: {}".format(report["error"])
         else:
-            best_sl_measured_vals.append(max(dataset_y_values))
+            outcome = "best measured per iteration {}".format(report["measured"])
+        print("{}: {} ({:.1f}s, {} requests, {:.1f}s queued)".format(
+            report["name"], outcome, report["seconds"], report["requests"],
+            report["queued_seconds"]))
+
+
+async def poll_until(check, wait_time, timeout=None, min_interval=0.5, backoff=1.5,
+                     settle=0, on_wait=None):
+    '''Polls a blocking status check until it reports completion
+
+    The first check runs immediately, so a phase that has already finished
+    costs a single request. Between checks the interval starts at
+    ``min_interval`` and grows by ``backoff`` up to ``wait_time``, so short
+    phases are noticed quickly and long ones are not polled more often than
+    before. Blocking client calls run in the default executor.
+
+    :param check: Function returning True once the awaited phase is complete
+    :type check: Callable[[], bool]
+    :param wait_time: Longest interval in seconds between two checks
+    :type wait_time: float
+    :param timeout: Seconds before giving up, defaults to None (wait forever)
+    :type timeout: float, optional
+    :param min_interval: First interval in seconds between checks, defaults to 0.5
+    :type min_interval: float, optional
+    :param backoff: Growth factor of the interval, defaults to 1.5
+    :type backoff: float, optional
+    :param settle: Seconds to wait before the first check, defaults to 0
+    :type settle: float, optional
+    :param on_wait: Called with the number of checks after each incomplete one
+    :type on_wait: Callable[[int], None], optional
+    :return: Number of checks made and seconds waited
+    :rtype: Tuple[int, float]
+    :raises TimeoutError: If the phase is not complete after ``timeout`` seconds
+    '''
 
-        # Retrain model w/ wait times
-        client.models.retrain(view_id)
-        _wait_on_data_view(client, dataset_id, view_id, wait_time, print_output)
+    loop = asyncio.get_running_loop()
+    start = monotonic()
+    deadline = None if timeout is None else start + timeout
+    interval = min(min_interval, wait_time)
+    polls = 0
+    if settle:
+        await asyncio.sleep(settle)
+    while True:
+        done = await loop.run_in_executor(None, check)
+        polls += 1
+        if done:
+            return polls, monotonic() - start
+        if on_wait is not None:
+            on_wait(polls)
+        pause = interval
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Still waiting after {} checks in {:.1f}s".format(
+                    polls, monotonic() - start))
+            pause = min(pause, remaining)
+        await asyncio.sleep(pause)
+        interval = min(interval * backoff, wait_time)
+
+
+def _run(coroutine):
+    '''Runs a coroutine to completion from synchronous code
+
+    Inside an already running event loop (e.g. a Jupyter kernel) the
+    coroutine is run on a fresh loop in a helper thread.
+    '''
 
-    if print_output:
-        print("SL finished!\n")
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
 
-    return (best_sl_pred_vals, best_sl_measured_vals)
+    result = {}
 
+    def target():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as exc:
+            result["error"] = exc
 
-def _wait_on_ingest(client, dataset_id, wait_time, print_output = True):
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def _wait_on_ingest(client, dataset_id, wait_time, print_output = True, timeout = None):
     # Wait for ingest to finish
-    sleep(wait_time)
-    while (client.data.get_ingest_status(dataset_id) != "Finished"):
+    def check():
+        return client.data.get_ingest_status(dataset_id) == "Finished"
+
+    def on_wait(polls):
         if print_output:
             print("Waiting for data ingest to complete...")
-        sleep(wait_time)
+
+    return _run(poll_until(check, wait_time, timeout=timeout, on_wait=on_wait))
 
 
-def _wait_on_data_view(client, dataset_id, view_id, wait_time, print_output = True):
-    is_view_ready = False
-    sleep(wait_time)
-    while (not is_view_ready):
-        sleep(wait_time)
+def _wait_on_data_view(client, dataset_id, view_id, wait_time, print_output = True,
+                       timeout = None, settle = 0):
+    def check():
         design_status = client.data_views.get_data_view_service_status(view_id)
-        if (design_status.experimental_design.ready and
-        design_status.predict.event.normalized_progress == 1.0):
-            is_view_ready = True
-            if print_output:
-                print("Design ready")
-        else:
+        return (design_status.experimental_design.ready and
+                design_status.predict.event.normalized_progress == 1.0)
+
+    def on_wait(polls):
+        if print_output:
             print("Waiting for design services...")
 
+    result = _run(poll_until(check, wait_time, timeout=timeout, settle=settle, on_wait=on_wait))
+    if print_output:
+        print("Design ready")
+    return result
+
 
-def _wait_on_design_run(client, design_id, view_id, wait_time, print_output = True):
-    design_processing = True
-    sleep(wait_time)
-    while design_processing:
+def _wait_on_design_run(client, design_id, view_id, wait_time, print_output = True, timeout = None):
+    def check():
         status = client.models.get_design_run_status(view_id, design_id).status
         if print_output:
             print("Design run status: {}".format(status))
+        return status == "Finished"
+
+    return _run(poll_until(check, wait_time, timeout=timeout))
 
-        if status != "Finished":
-            sleep(wait_time)
-        else:
-            design_processing = False
-            
 
 def plot_sl_results(measured, predicted, init_best):
 #     plt.rcParams.update({'figure.figsize':(8, 6), 'font.size':18})
@@ -0,0 +1,129 @@
+"""
+Gradient-free, population-based optimization of an acquisition function.
+
+Instead of a single L-BFGS-B run, whose finite-difference gradients cost
+2*d extra predictions per step, the optimizer proposes a whole population
+per step: a Latin hypercube to start, then samples from a diagonal Gaussian
+refit to the best candidates (the cross-entropy method). Each population is
+scored with one batched prediction, and a diverse top-k set of materials is
+returned.
+"""
+
+### Standard Libraries ###
+import collections
+from typing import Callable, Iterable, List, Optional
+
+### Third-Party Libraries ###
+import numpy as np
+from citrination_client.models.client import ModelsClient
+
+### Local Modules ###
+from converters import DomainArrays, candidates_from_matrix
+
+
+def latin_hypercube(n: int, lower: np.ndarray, upper: np.ndarray, rng: np.random.RandomState) -> np.ndarray:
+    """
+    Samples a Latin hypercube within bounds
+
+    ARGS
+        n (int)                       | the number of samples
+        lower (np.ndarray)            | the lower bound of each dimension
+        upper (np.ndarray)            | the upper bound of each dimension
+        rng (np.random.RandomState)   | the random number generator
+
+    RETURNS
+        (np.ndarray)                  | (n, d) samples, one per stratum of every dimension
+    """
+
+    d = len(lower)
+    strata = np.array([rng.permutation(n) for _ in range(d)]).T
+    unit = (strata + rng.random_sample((n, d))) / n
+    return lower + unit * (upper - lower)
+
+
+def batch_acquisition(materials: List[dict], view_id: str, models_client: ModelsClient, target_property: str) -> np.ndarray:
+    """
+    Applies the acquisition function to a population with one prediction request
+
+    ARGS
+        materials (List[dict])         | dictionaries of data view column names and values
+        view_id (str)                  | the id of the Citrination model dataview we want to use for prediction
+        models_client (ModelsClient)   | a CitrinationClient models client
+        target_property (str)          | the name of the optimized property
+
+    RETURNS
+        (np.ndarray)                   | the loss of the predicted target of each material
+    """
+
+    predicted_materials = models_client.predict(view_id, materials)
+    target_name = 'Property {}'.format(target_property)
+    return np.array([float(predicted.get_value(target_name).loss) for predicted in predicted_materials])
+
+
+def diverse_top_k(vecs: np.ndarray, scores: np.ndarray, k: int, min_distance: float) -> List[int]:
+    """
+    Greedily picks the best vectors that are not too close to better picks
+
+    ARGS
+        vecs (np.ndarray)        | (n, d) vectors scaled to the unit cube
+        scores (np.ndarray)      | the score of each vector, higher is better
+        k (int)                  | the number of vectors to pick
+        min_distance (float)     | the smallest euclidean distance between two picks
+
+    RETURNS
+        (List[int])              | indices of the picks, best first
+    """
+
+    chosen = []
+    for i in np.argsort(-scores, kind='stable'):
+        if all(np.linalg.norm(vecs[i] - vecs[j]) >= min_distance for j in chosen):
+            chosen.append(i)
+            if len(chosen) == k:
+                break
+    return chosen
+
+
+def design_experiment_batch(domain: Iterable[collections.namedtuple], f_acq_batch: Callable[[List[dict]], np.ndarray],
+                            top_k: int = 5, population: int = 32, generations: int = 10, elite_fraction: float = 0.25,
+                            min_distance: float = 0.05, seed: Optional[int] = None) -> List[dict]:
+    """
+    Optimizes over the domain one population at a time, returning a diverse set of materials that maximize the acquisition function.
+
+    ARGS
+        domain (Iterable[collections.namedtuple]) | The design space used to set boundaries
+        f_acq_batch (Callable)                    | The acquisition function of a list of materials, e.g. partial(batch_acquisition, ...)
+        top_k (int)                               | The number of materials returned
+        population (int)                          | The number of materials evaluated per step
+        generations (int)                         | The number of steps after the Latin hypercube
+        elite_fraction (float)                    | The fraction of a population the next one is fit to
+        min_distance (float)                      | The smallest distance between returned materials, in units of the domain ranges
+        seed (Optional[int])                      | The seed of the random number generator
+
+    RETURNS
+        (List[dict])                              | Up to top_k optimized materials as dictionaries, best first
+    """
+
+    domain = DomainArrays(domain)
+    rng = np.random.RandomState(seed)
+    lower, upper = domain.lower, domain.upper
+    span = np.where(upper > lower, upper - lower, 1.0)
+    n_elite = max(2, int(round(elite_fraction * population)))
+
+    evaluated, scores = [], []
+    vecs = latin_hypercube(population, lower, upper, rng)
+    for generation in range(generations + 1):
+        population_scores = np.asarray(f_acq_batch(candidates_from_matrix(vecs, domain)), dtype=float)
+        evaluated.append(vecs)
+        scores.append(population_scores)
+        if generation == generations:
+            break
+
+        # Refit the sampling distribution to the best materials seen so far
+        all_vecs, all_scores = np.vstack(evaluated), np.concatenate(scores)
+        elite = all_vecs[np.argsort(-all_scores, kind='stable')[:n_elite]]
+        mean, std = elite.mean(axis=0), elite.std(axis=0) + 1e-3 * span
+        vecs = domain.clip(mean + std * rng.standard_normal((population, len(lower))))
+
+    all_vecs, all_scores = np.vstack(evaluated), np.concatenate(scores)
+    chosen = diverse_top_k((all_vecs - lower) / span, all_scores, top_k, min_distance)
+    return candidates_from_matrix(all_vecs[chosen], domain)
@@ -0,0 +1,210 @@
+"""
+Batched, concurrent candidate prediction for PyCC.
+
+Single-candidate predictions submitted from any number of threads are
+coalesced into size-bounded batches, and the batches are sent concurrently
+over a pooled HTTP session. Callers keep a per-material API and get a
+future for every material.
+"""
+
+### Standard Libraries ###
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+### Third-Party Libraries ###
+import requests
+from requests.adapters import HTTPAdapter
+from citrination_client.base.response_handling import check_for_rate_limiting
+from citrination_client.models.client import ModelsClient
+
+
+class SessionModelsClient(ModelsClient):
+    """
+    A PyCC models client that reuses pooled keep-alive connections
+
+    PyCC opens a new connection for every request; this client sends its
+    requests through one requests.Session so that concurrent batches share
+    a pool of connections to the Citrination host.
+
+    ARGS
+        api_key (str)               | the Citrination API key
+        webserver_host (str)        | the Citrination site url
+        pool_size (int)             | the number of pooled connections
+    """
+
+    def __init__(self, api_key: str, webserver_host: str = 'https://citrination.com', pool_size: int = 8, **kwargs):
+        super().__init__(api_key, webserver_host, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method: str, route: str, headers: Optional[dict] = None, failure_message: Optional[str] = None, **kwargs) -> requests.Response:
+        headers = self._get_headers(headers)
+        response_lambda = lambda: self.session.request(
+            method, self._get_qualified_route(route), headers=headers, verify=False, proxies=self.proxies, **kwargs)
+        response = check_for_rate_limiting(response_lambda(), response_lambda)
+        return self._handle_response(response, failure_message)
+
+    def _get(self, route, headers=None, failure_message=None):
+        return self._request('GET', route, headers, failure_message)
+
+    def _post(self, route, data, headers=None, failure_message=None):
+        return self._request('POST', route, headers, failure_message, data=data)
+
+    def _put(self, route, data, headers=None, failure_message=None):
+        return self._request('PUT', route, headers, failure_message, data=data)
+
+    def _patch(self, route, data, headers=None, failure_message=None):
+        return self._request('PATCH', route, headers, failure_message, data=data)
+
+    def _delete(self, route, headers=None, failure_message=None):
+        return self._request('DELETE', route, headers, failure_message)
+
+    def close(self):
+        self.session.close()
+
+
+class BatchingPredictor(object):
+    """
+    Coalesces single-candidate predictions into concurrent batched requests
+
+    A dispatcher thread collects submitted materials until a batch holds
+    max_batch_size candidates or max_delay seconds have passed since its
+    first candidate, then hands the batch to a pool of workers that call
+    models_client.predict. Each submitted material gets its own future.
+
+    ARGS
+        models_client (ModelsClient) | a PyCC models client, e.g. a SessionModelsClient
+        view_id (str)                | the id of the Citrination model dataview used for prediction
+        max_batch_size (int)         | the most candidates sent in one predict request
+        max_delay (float)            | seconds a partial batch waits for more candidates
+        workers (int)                | the number of batches predicted concurrently
+        method (str)                 | the PyCC prediction method, "scalar" or "scalar_from_distribution"
+        use_prior (bool)             | whether to apply the priors of the property descriptors
+    """
+
+    def __init__(self, models_client: ModelsClient, view_id: str, max_batch_size: int = 50, max_delay: float = 0.05,
+                 workers: int = 4, method: str = 'scalar', use_prior: bool = True):
+        self.models_client = models_client
+        self.view_id = view_id
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.method = method
+        self.use_prior = use_prior
+        self.requests = 0
+        self.candidates = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, material: dict) -> Future:
+        """
+        Queues one material for prediction
+
+        ARGS
+            material (dict)   | a dictionary of data view column names and values
+
+        RETURNS
+            (Future)          | resolves to the PyCC PredictionResult of the material
+        """
+
+        if self._closed:
+            raise RuntimeError('BatchingPredictor is closed')
+        future = Future()
+        self._queue.put((material, future))
+        return future
+
+    def predict(self, material: dict):
+        """
+        Predicts one material, blocking until its batch returns
+
+        ARGS
+            material (dict)   | a dictionary of data view column names and values
+
+        RETURNS
+            (PredictionResult) | a models client PredictionResult containing value/loss
+        """
+
+        return self.submit(material).result()
+
+    def predict_many(self, materials: Iterable[dict]) -> List:
+        """
+        Predicts many materials through the same batches as single submissions
+
+        ARGS
+            materials (Iterable[dict])   | dictionaries of data view column names and values
+
+        RETURNS
+            (List[PredictionResult])     | one PredictionResult per material, in order
+        """
+
+        futures = [self.submit(material) for material in materials]
+        return [future.result() for future in futures]
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._executor.submit(self._predict_batch, batch)
+                    return
+                batch.append(item)
+            self._executor.submit(self._predict_batch, batch)
+
+    def _predict_batch(self, batch: list):
+        running = [(material, future) for material, future in batch if future.set_running_or_notify_cancel()]
+        if not running:
+            return
+        with self._lock:
+            self.requests += 1
+            self.candidates += len(running)
+        results = []
+        error = None
+        try:
+            results = list(self.models_client.predict(self.view_id, [material for material, _ in running],
+                                                      self.method, self.use_prior))
+            if len(results) != len(running):
+                error = RuntimeError('Prediction returned {} results for {} candidates'.format(
+                    len(results), len(running)))
+        except Exception as exc:
+            error = exc
+        finally:
+            # Every future is resolved, whatever the batch returned
+            for i, (_, future) in enumerate(running):
+                if error is None and i < len(results):
+                    future.set_result(results[i])
+                else:
+                    future.set_exception(error or RuntimeError('Prediction was interrupted'))
+
+    def close(self):
+        """
+        Sends the pending batches and waits for them to return
+        """
+
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._dispatcher.join()
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,133 @@
+"""
+Array-in/array-out conversion between optimizer vectors, candidates and PIFs.
+
+material_from_vector and dict_to_pif convert one point at a time. These
+converters take an (n x d) matrix and the build_domain bounds and produce
+every candidate payload, or every PIF record, in one pass: values are
+formatted to strings with a single numpy call and PIF records are filled
+into a template built once per domain.
+"""
+
+### Standard Libraries ###
+import collections
+import json
+from typing import IO, Iterable, List, Optional
+
+### Third-Party Libraries ###
+import numpy as np
+
+
+class DomainArrays(object):
+    """
+    The design space of build_domain as column names and bound arrays
+
+    ARGS
+        domain (Iterable[collections.namedtuple]) | the conditions returned by build_domain
+    """
+
+    def __init__(self, domain: Iterable[collections.namedtuple]):
+        domain = list(domain)
+        self.names = [cnd.name for cnd in domain]
+        self.lower = np.array([cnd.min_val for cnd in domain], dtype=float)
+        self.upper = np.array([cnd.max_val for cnd in domain], dtype=float)
+
+    def clip(self, vecs: np.ndarray) -> np.ndarray:
+        """
+        Clips vectors to the bounds of the domain
+
+        ARGS
+            vecs (np.ndarray)   | (n, d) values of the independent variables
+
+        RETURNS
+            (np.ndarray)        | the clipped values
+        """
+
+        return np.clip(vecs, self.lower, self.upper)
+
+
+def format_matrix(vecs: np.ndarray) -> np.ndarray:
+    """
+    Formats every value of a matrix as material_from_vector does, in one call
+
+    ARGS
+        vecs (np.ndarray)   | (n, d) values of the independent variables
+
+    RETURNS
+        (np.ndarray)        | (n, d) array of the str() of each value
+    """
+
+    return np.atleast_2d(np.asarray(vecs, dtype=float)).astype(str)
+
+
+def candidates_from_matrix(vecs: np.ndarray, domain: DomainArrays) -> List[dict]:
+    """
+    Turns a matrix into the candidate payload of one predict request
+
+    ARGS
+        vecs (np.ndarray)       | (n, d) values of the independent variables
+        domain (DomainArrays)   | the design space the columns belong to
+
+    RETURNS
+        (List[dict])            | a material per row, as material_from_vector would build it
+    """
+
+    names = domain.names
+    return [dict(zip(names, row)) for row in format_matrix(vecs).tolist()]
+
+
+def pif_template(domain: DomainArrays, target_property: str) -> str:
+    """
+    Builds the %-template of the compact PIF record of one material
+
+    ARGS
+        domain (DomainArrays)    | the design space the columns belong to
+        target_property (str)    | the name of the optimized property
+
+    RETURNS
+        (str)                    | a template taking the system name and the d formatted values
+    """
+
+    conditions = ','.join(
+        '{{"name":{},"scalars":%s}}'.format(json.dumps(name).replace('%', '%%')) for name in domain.names)
+    return ('{"names":[%s],"properties":[{"name":' + json.dumps(target_property).replace('%', '%%') +
+            ',"conditions":[' + conditions + ']}],"category":"system"}')
+
+
+def pif_records_from_matrix(vecs: np.ndarray, domain: DomainArrays, target_property: str, system_name: str) -> List[str]:
+    """
+    Turns a matrix into compact PIF records, as dict_to_pif and pif.dumps would
+
+    ARGS
+        vecs (np.ndarray)        | (n, d) values of the independent variables
+        domain (DomainArrays)    | the design space the columns belong to
+        target_property (str)    | the name of the optimized property
+        system_name (str)        | the name given to every system
+
+    RETURNS
+        (List[str])              | the JSON record of each material
+    """
+
+    template = pif_template(domain, target_property)
+    name = json.dumps(system_name)
+    return [template % ((name,) + tuple(json.dumps(value) for value in row))
+            for row in format_matrix(vecs).tolist()]
+
+
+def dump_pifs_from_matrix(vecs: np.ndarray, domain: DomainArrays, target_property: str, system_name: str, fp: IO[str]) -> int:
+    """
+    Writes the PIFs of a matrix as one JSON array, without building System objects
+
+    ARGS
+        vecs (np.ndarray)        | (n, d) values of the independent variables
+        domain (DomainArrays)    | the design space the columns belong to
+        target_property (str)    | the name of the optimized property
+        system_name (str)        | the name given to every system
+        fp (IO[str])             | the open file the array is written to
+
+    RETURNS
+        (int)                    | the number of records written
+    """
+
+    records = pif_records_from_matrix(vecs, domain, target_property, system_name)
+    fp.write('[' + ','.join(records) + ']')
+    return len(records)
@@ -0,0 +1,284 @@
+"""
+Caching of PyCC predictions keyed by data view, model generation and inputs.
+
+Optimizers such as L-BFGS-B probe the same vectors again while they search.
+Repeated inputs are answered from an LRU cache (optionally persisted to
+SQLite) instead of another predict request; with a quantum, nearly
+identical inputs share an entry too. Retraining a view through
+CachingModelsClient starts a new model generation for it and drops its
+cached predictions. Citrination does not report a model version, so entries
+also expire after max_age seconds to bound how stale a prediction can be
+when the model is retrained elsewhere.
+"""
+
+### Standard Libraries ###
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable, List, Optional, Tuple
+
+### Third-Party Libraries ###
+from citrination_client.models.client import ModelsClient
+from citrination_client.models.predicted_value import PredictedValue
+from citrination_client.models.prediction_result import PredictionResult
+
+
+def _dump_result(result) -> str:
+    if isinstance(result, PredictionResult):
+        values = {key: {'value': predicted.value, 'loss': predicted.loss,
+                        'class_probabilities': predicted.class_probabilities}
+                  for key, predicted in ((key, result.get_value(key)) for key in result.all_keys())}
+        return json.dumps({'values': values})
+    return json.dumps({'result': result})
+
+
+def _load_result(text: str):
+    state = json.loads(text)
+    if 'values' not in state:
+        return state['result']
+    result = PredictionResult()
+    for key, predicted in state['values'].items():
+        result.add_value(key, PredictedValue(key, predicted['value'], predicted['loss'], predicted['class_probabilities']))
+    return result
+
+
+class PredictionCache(object):
+    """
+    LRU cache of prediction results keyed on (view_id, generation, inputs)
+
+    Inputs are matched exactly unless a quantum is given, in which case
+    numeric inputs are rounded to the nearest multiple of it; other inputs
+    are compared as strings. Each view has a generation that is bumped by
+    invalidate(), so results of an older model are never returned. Entries
+    older than max_age seconds are treated as misses.
+
+    ARGS
+        maxsize (int)               | the number of results kept in memory
+        quantum (Optional[float])   | the resolution inputs are rounded to, None matches exactly
+        path (Optional[str])        | a SQLite file persisting results across runs
+        max_age (Optional[float])   | seconds a result is reused for, None keeps results until invalidated
+    """
+
+    def __init__(self, maxsize: int = 100000, quantum: Optional[float] = None, path: Optional[str] = None,
+                 max_age: Optional[float] = 3600.0):
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.RLock()
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS predictions '
+                '(key TEXT PRIMARY KEY, view_id TEXT NOT NULL, result TEXT NOT NULL, created REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS generations (view_id TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+            self._connection.commit()
+            self._generations = dict(self._connection.execute('SELECT view_id, generation FROM generations'))
+
+    def _quantize(self, value) -> Hashable:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+        return value if self.quantum is None else round(value / self.quantum)
+
+    def _expired(self, created: float) -> bool:
+        return self.max_age is not None and time.time() - created > self.max_age
+
+    def generation(self, view_id) -> int:
+        """
+        Returns the model generation of a view
+
+        ARGS
+            view_id (str)      | the id of the Citrination model dataview
+
+        RETURNS
+            (int)              | the number of times the view was invalidated
+        """
+
+        return self._generations.get(str(view_id), 0)
+
+    def key(self, view_id, material: dict, *options) -> Tuple:
+        """
+        Builds the cache key of a material
+
+        ARGS
+            view_id (str)      | the id of the Citrination model dataview
+            material (dict)    | a dictionary of data view column names and values
+            options            | other arguments that change the prediction, e.g. the method
+
+        RETURNS
+            (Tuple)            | the hashable key
+        """
+
+        inputs = tuple(sorted((name, self._quantize(value)) for name, value in material.items()))
+        return (str(view_id), self.generation(view_id), options, inputs)
+
+    def get(self, key: Tuple):
+        """
+        Looks up a prediction in memory, then on disk
+
+        ARGS
+            key (Tuple)        | a key built by key()
+
+        RETURNS
+            (Optional[PredictionResult]) | the cached result, None on a miss
+        """
+
+        with self._lock:
+            if key in self._entries:
+                result, created = self._entries[key]
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+            if self._connection is not None:
+                row = self._connection.execute(
+                    'SELECT result, created FROM predictions WHERE key = ?', (json.dumps(key),)).fetchone()
+                if row and not self._expired(row[1]):
+                    self.disk_hits += 1
+                    result = _load_result(row[0])
+                    self._remember(key, result, row[1])
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple, result):
+        """
+        Stores a prediction
+
+        ARGS
+            key (Tuple)                 | a key built by key()
+            result (PredictionResult)   | the prediction of the keyed material
+        """
+
+        created = time.time()
+        with self._lock:
+            self._remember(key, result, created)
+            if self._connection is not None:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO predictions (key, view_id, result, created) VALUES (?, ?, ?, ?)',
+                    (json.dumps(key), key[0], _dump_result(result), created))
+                self._connection.commit()
+
+    def _remember(self, key: Tuple, result, created: float):
+        self._entries[key] = (result, created)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, view_id):
+        """
+        Drops every prediction of a view and starts a new model generation
+
+        ARGS
+            view_id (str)      | the id of the retrained Citrination model dataview
+        """
+
+        view_id = str(view_id)
+        with self._lock:
+            self._generations[view_id] = self.generation(view_id) + 1
+            for key in [key for key in self._entries if key[0] == view_id]:
+                del self._entries[key]
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM predictions WHERE view_id = ?', (view_id,))
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO generations (view_id, generation) VALUES (?, ?)',
+                    (view_id, self._generations[view_id]))
+                self._connection.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'PredictionCache(hits={}, disk_hits={}, misses={}, hit_rate={:.1%})'.format(
+            self.hits, self.disk_hits, self.misses, self.hit_rate)
+
+
+class CachingModelsClient(object):
+    """
+    Wraps a PyCC models client so predictions go through a PredictionCache
+
+    predict() only sends the candidates that miss the cache, in one request,
+    and retrain() invalidates the cached predictions of the retrained view.
+    Every other attribute is forwarded to the wrapped client, so this can
+    stand in for client.models, including inside a BatchingPredictor.
+
+    ARGS
+        models_client (ModelsClient)  | a PyCC models client
+        cache (PredictionCache)       | the cache of predictions
+    """
+
+    def __init__(self, models_client: ModelsClient, cache: Optional[PredictionCache] = None):
+        self.models_client = models_client
+        self.cache = cache if cache is not None else PredictionCache()
+
+    def __getattr__(self, name):
+        return getattr(self.models_client, name)
+
+    def predict(self, data_view_id, candidates: Iterable[dict], method: str = 'scalar', use_prior: bool = True) -> List:
+        """
+        Predicts candidates, reusing cached results
+
+        ARGS
+            data_view_id (str)             | the id of the Citrination model dataview
+            candidates (Iterable[dict])    | dictionaries of data view column names and values
+            method (str)                   | the PyCC prediction method
+            use_prior (bool)               | whether to apply the priors of the property descriptors
+
+        RETURNS
+            (List[PredictionResult])       | one PredictionResult per candidate, in order
+        """
+
+        candidates = list(candidates)
+        keys = [self.cache.key(data_view_id, candidate, method, use_prior) for candidate in candidates]
+        results = [self.cache.get(key) for key in keys]
+        # Candidates that quantize to the same key are only predicted once
+        missing = OrderedDict()
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(keys[i], i)
+        if missing:
+            predicted = self.models_client.predict(
+                data_view_id, [candidates[i] for i in missing.values()], method, use_prior)
+            fresh = dict(zip(missing, predicted))
+            for key, result in fresh.items():
+                self.cache.put(key, result)
+            results = [fresh[key] if result is None else result for key, result in zip(keys, results)]
+        return results
+
+    def retrain(self, dataview_id) -> bool:
+        """
+        Starts a model retraining and invalidates the cached predictions of the view
+
+        ARGS
+            dataview_id (str)   | the id of the Citrination model dataview
+
+        RETURNS
+            (bool)              | True if the retrain was accepted
+        """
+
+        retrained = self.models_client.retrain(dataview_id)
+        self.cache.invalidate(dataview_id)
+        return retrained
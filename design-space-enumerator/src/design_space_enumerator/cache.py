@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memoization of pymatgen formula reduction.
+
+Reduced formulas are kept in an in-process LRU cache and, optionally, in a
+SQLite file so that repeated runs over overlapping element palettes skip the
+Composition constructor for formulas they have already seen.
+"""
+
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from pymatgen import Composition
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+# Number of new entries buffered before they are written to disk
+FLUSH_SIZE = 1000
+
+
+class FormulaCache(object):
+    """[Cache of reduced formulas keyed by the raw formula string]
+
+    Arguments:
+        maxsize {int} -- [Number of entries kept in memory] (default: {100000})
+        path {Optional[str]} -- [SQLite file persisting entries across runs] (default: {None})
+        readonly {bool} -- [Never write to the SQLite file] (default: {False})
+    """
+
+    def __init__(self, maxsize: int = 100000, path: Optional[str] = None, readonly: bool = False):
+        self.maxsize = maxsize
+        self.path = path
+        self.readonly = readonly
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = []
+        self._connection = None
+        if path:
+            self._connection = self._connect(path, readonly)
+
+    @staticmethod
+    def _connect(path: str, readonly: bool) -> sqlite3.Connection:
+        if readonly:
+            return sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS formulas (raw TEXT PRIMARY KEY, reduced TEXT NOT NULL)')
+        connection.commit()
+        return connection
+
+    def reduced_formula(self, formula: str) -> str:
+        """[Looks up or computes the reduced formula of a raw formula]
+
+        Arguments:
+            formula {str} -- [A raw chemical formula such as BaTiO]
+
+        Returns:
+            str -- [The pymatgen reduced formula]
+        """
+        reduced_formula = self._entries.get(formula)
+        if reduced_formula is not None:
+            self._entries.move_to_end(formula)
+            self.hits += 1
+            return reduced_formula
+        if self._connection is not None:
+            row = self._connection.execute(
+                'SELECT reduced FROM formulas WHERE raw = ?', (formula,)).fetchone()
+            if row:
+                self.disk_hits += 1
+                self._remember(formula, row[0])
+                return row[0]
+        self.misses += 1
+        reduced_formula = Composition(formula).reduced_formula
+        self._remember(formula, reduced_formula)
+        self._pending.append((formula, reduced_formula))
+        if not self.readonly and len(self._pending) >= FLUSH_SIZE:
+            self.flush()
+        return reduced_formula
+
+    def _remember(self, formula: str, reduced_formula: str):
+        self._entries[formula] = reduced_formula
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def drain(self) -> Tuple[List[Tuple[str, str]], int, int, int]:
+        """[Hands over new entries and counters accumulated since the last drain]
+
+        Returns:
+            Tuple[List[Tuple[str, str]], int, int, int] -- [New entries, hits, disk hits and misses]
+        """
+        report = (self._pending, self.hits, self.disk_hits, self.misses)
+        self._pending = []
+        self.hits = self.disk_hits = self.misses = 0
+        return report
+
+    def absorb(self, entries: Iterable[Tuple[str, str]], hits: int, disk_hits: int, misses: int):
+        """[Merges a report drained from a cache in another process]
+
+        Arguments:
+            entries {Iterable[Tuple[str, str]]} -- [New (raw, reduced) entries]
+            hits {int} -- [In-memory hits of the other cache]
+            disk_hits {int} -- [Disk hits of the other cache]
+            misses {int} -- [Misses of the other cache]
+        """
+        for formula, reduced_formula in entries:
+            self._remember(formula, reduced_formula)
+            self._pending.append((formula, reduced_formula))
+        self.hits += hits
+        self.disk_hits += disk_hits
+        self.misses += misses
+        if not self.readonly and len(self._pending) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """[Writes buffered entries to the SQLite file]
+        """
+        if self._connection is not None and not self.readonly and self._pending:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO formulas (raw, reduced) VALUES (?, ?)', self._pending)
+            self._connection.commit()
+            _logger.debug('Persisted {} reduced formulas to {}'.format(len(self._pending), self.path))
+        if not self.readonly:
+            self._pending = []
+
+    def close(self):
+        """[Flushes and closes the SQLite file]
+        """
+        self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'FormulaCache(hits={}, disk_hits={}, misses={})'.format(
+            self.hits, self.disk_hits, self.misses)
@@ -9,15 +9,26 @@ import argparse
 import sys
 import logging
 import typing
+import numpy as np
 import pandas as pd
 import os
+import tempfile
+import textwrap
 import pypif
 from citrination_client import CitrinationClient
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 from pymatgen import Composition
 from itertools import combinations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from design_space_enumerator import __version__
+from design_space_enumerator.cache import FormulaCache
+from design_space_enumerator.pruning import Rule, admits_all, comb, build_rules, pruned_combinations, split_amount_rules
+from design_space_enumerator.stoichiometry import electronegativity_order, grid_batches, iter_stoichiometry_batches, reduced_grid
+from design_space_enumerator.upload import UploadManifest, data_digest, upload_shards, write_pif_shards
+from design_space_enumerator.waiting import Waiter, wait_for_ingest
+from design_space_enumerator.writers import EXTENSIONS, element_amounts, open_writer
 
 __author__ = "malcolm@davidsonnanosolutions.com"
 __copyright__ = "malcolm@davidsonnanosolutions.com"
@@ -25,47 +36,409 @@ __license__ = "mit"
 
 _logger = logging.getLogger(__name__)
 
+# Upper bound on the combinations screened by one worker task
+MAX_SHARD_SIZE = 50000
 
-def enumerate_formula(elements: Iterable[str], num_members: int) -> list:
+# Read-only formula cache of a worker process, set by _init_worker
+_worker_cache = None
+
+
+class FormulaIndex(object):
+    """[Order preserving deduplication index of reduced formulas]
+
+    Membership checks are hash lookups, and the counters record how many
+    candidates were screened and how many collapsed onto an existing formula.
+    """
+
+    def __init__(self):
+        self._formulas = {}
+        self.candidates = 0
+        self.duplicates = 0
+
+    def add(self, formula: str) -> bool:
+        """[Records a screened formula]
+
+        Arguments:
+            formula {str} -- [A reduced chemical formula]
+
+        Returns:
+            bool -- [True if the formula had not been seen before]
+        """
+        self.candidates += 1
+        if formula in self._formulas:
+            self.duplicates += 1
+            return False
+        self._formulas[formula] = None
+        return True
+
+    def merge(self, formulas: Iterable[str], candidates: int) -> List[str]:
+        """[Folds formulas screened by another index into this one]
+
+        Arguments:
+            formulas {Iterable[str]} -- [Unique formulas of the other index, in order]
+            candidates {int} -- [Number of candidates the other index screened]
+
+        Returns:
+            List[str] -- [The formulas that were new to this index]
+        """
+        formulas = list(formulas)
+        new_formulas = [formula for formula in formulas if self.add(formula)]
+        collapsed = candidates - len(formulas)
+        self.candidates += collapsed
+        self.duplicates += collapsed
+        return new_formulas
+
+    def __contains__(self, formula: str) -> bool:
+        return formula in self._formulas
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._formulas)
+
+    def __len__(self) -> int:
+        return len(self._formulas)
+
+    def __repr__(self):
+        return 'FormulaIndex(unique={}, duplicates={})'.format(len(self), self.duplicates)
+
+
+def enumerate_formula(elements: Iterable[str], num_members: int, stream: bool = False, index: Optional[FormulaIndex] = None, workers: int = 1, max_coefficient: Optional[int] = None, step: Optional[float] = None, cache: Optional[FormulaCache] = None, rules: Sequence[Rule] = ()) -> Iterable[str]:
     """[Generates a list of chemical fromulas]
 
     Arguments:
         elements {list} -- [Elements to build formulas from]
         num_members {int} -- [The number of elements in the formula]
 
+    Keyword Arguments:
+        stream {bool} -- [Lazily yield screened formulas instead of building a list] (default: {False})
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        workers {int} -- [Number of processes screening candidates] (default: {1})
+        max_coefficient {Optional[int]} -- [Sweep integer coefficients up to this value] (default: {None})
+        step {Optional[float]} -- [Sweep fractions on a simplex with this spacing] (default: {None})
+        cache {Optional[FormulaCache]} -- [Cache of previously reduced formulas] (default: {None})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
+
     Returns:
-        list -- [Permutations of the given formula]
+        Iterable[str] -- [Permutations of the given formula]
     """
+    if max_coefficient or step:
+        if cache is not None:
+            raise ValueError('Stoichiometry grids are formatted as reduced formulas and cannot use a formula cache')
+        if workers > 1:
+            formulas = iter_stoichiometry_parallel(elements, num_members, workers, max_coefficient=max_coefficient, step=step, index=index, rules=rules)
+        else:
+            formulas = iter_stoichiometry(elements, num_members, max_coefficient=max_coefficient, step=step, index=index, rules=rules)
+        return formulas if stream else list(formulas)
+    if workers > 1:
+        formulas = iter_formulas_parallel(elements, num_members, workers, index=index, cache=cache, rules=rules)
+        return formulas if stream else list(formulas)
+    if stream:
+        return iter_formulas(elements, num_members, index=index, cache=cache, rules=rules)
     try:
         enum = ["".join(x)
-                for x in combinations(elements, num_members)]
+                for x in pruned_combinations(elements, num_members, rules)]
     except Exception as exc:
         print('-- Could not compute combinations --')
         raise(exc)
-    return screen_formulas(enum)
+    return screen_formulas(enum, index=index, cache=cache)
 
 
-def screen_formulas(candidates: Iterable[str]) -> Iterable[str]:
-    """[Filters unique chemical compositions]
+def iter_formulas(elements: Iterable[str], num_members: int, index: Optional[FormulaIndex] = None, cache: Optional[FormulaCache] = None, rules: Sequence[Rule] = ()) -> Iterator[str]:
+    """[Lazily generates screened chemical formulas]
+
+    Combinations are joined and screened one at a time, so only the unique
+    reduced formulas seen so far are held in memory.
 
     Arguments:
-        candidates {Iterable[str]} -- [List of chemical formula candidates]
+        elements {list} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        cache {Optional[FormulaCache]} -- [Cache of previously reduced formulas] (default: {None})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
 
     Returns:
-        Iterable[str] -- [Filtered list of candidates]
+        Iterator[str] -- [Unique reduced formulas in enumeration order]
     """
+    candidates = ("".join(x) for x in pruned_combinations(elements, num_members, rules))
+    return iter_screened_formulas(candidates, index=index, cache=cache)
+
+
+def iter_screened_formulas(candidates: Iterable[str], index: Optional[FormulaIndex] = None, cache: Optional[FormulaCache] = None) -> Iterator[str]:
+    """[Lazily filters unique chemical compositions]
+
+    Arguments:
+        candidates {Iterable[str]} -- [Chemical formula candidates]
+
+    Keyword Arguments:
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        cache {Optional[FormulaCache]} -- [Cache of previously reduced formulas] (default: {None})
+
+    Returns:
+        Iterator[str] -- [Unique reduced formulas in first-seen order]
+    """
+    if index is None:
+        index = FormulaIndex()
     try:
-        formulas = []
         for formula in candidates:
-            comp = Composition(formula)
-            if comp.reduced_formula not in formulas:
-                formulas.append(comp.reduced_formula)
-        return formulas
+            if cache is not None:
+                reduced_formula = cache.reduced_formula(formula)
+            else:
+                reduced_formula = Composition(formula).reduced_formula
+            if index.add(reduced_formula):
+                yield reduced_formula
     except Exception as exc:
         print('-- Could not filter candidates --')
         raise(exc)
 
 
+def iter_stoichiometry(elements: Iterable[str], num_members: int, max_coefficient: Optional[int] = None, step: Optional[float] = None, index: Optional[FormulaIndex] = None, rules: Sequence[Rule] = ()) -> Iterator[str]:
+    """[Lazily generates reduced formulas over a stoichiometry grid]
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Sweep integer coefficients up to this value] (default: {None})
+        step {Optional[float]} -- [Sweep fractions on a simplex with this spacing] (default: {None})
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
+
+    Returns:
+        Iterator[str] -- [Unique reduced formulas]
+    """
+    if index is None:
+        index = FormulaIndex()
+    try:
+        for formulas, candidates in iter_stoichiometry_batches(elements, num_members, max_coefficient=max_coefficient, step=step, rules=rules):
+            yield from index.merge(formulas, candidates)
+    except Exception as exc:
+        print('-- Could not compute stoichiometry grid --')
+        raise(exc)
+
+
+def _stoichiometry_shard(shard: Tuple[List[str], int, int, int, np.ndarray, int, Sequence[Rule]]) -> Tuple[List[str], int]:
+    """[Formats the stoichiometry grid over one slice of the element sets in a worker process]
+
+    Arguments:
+        shard {Tuple[List[str], int, int, int, np.ndarray, int, Sequence[Rule]]} -- [Palette, members, start and stop rank, grid, collapsed vectors, rules]
+
+    Returns:
+        Tuple[List[str], int] -- [Formulas of the slice and candidates screened]
+    """
+    palette, num_members, start, stop, grid, collapsed, rules = shard
+    set_rules, amount_rules = split_amount_rules(rules)
+    symbol_sets = (symbols for symbols in combinations_slice(palette, num_members, start, stop)
+                   if admits_all(set_rules, symbols))
+    formulas, candidates = [], 0
+    for batch, batch_candidates in grid_batches(symbol_sets, grid, collapsed, amount_rules=amount_rules):
+        formulas.extend(batch)
+        candidates += batch_candidates
+    return formulas, candidates
+
+
+def iter_stoichiometry_parallel(elements: Iterable[str], num_members: int, workers: int, max_coefficient: Optional[int] = None, step: Optional[float] = None, index: Optional[FormulaIndex] = None, rules: Sequence[Rule] = ()) -> Iterator[str]:
+    """[Formats a stoichiometry grid across a process pool]
+
+    The element sets are split into contiguous shards sized so that each
+    holds at most MAX_SHARD_SIZE formulas, and the results are merged in
+    shard order, so the output matches the serial enumeration.
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+        workers {int} -- [Number of worker processes]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Sweep integer coefficients up to this value] (default: {None})
+        step {Optional[float]} -- [Sweep fractions on a simplex with this spacing] (default: {None})
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
+
+    Returns:
+        Iterator[str] -- [Unique reduced formulas in enumeration order]
+    """
+    palette = electronegativity_order(dict.fromkeys(elements))
+    rules = list(rules)
+    if index is None:
+        index = FormulaIndex()
+    grid, collapsed = reduced_grid(num_members, max_coefficient=max_coefficient, step=step)
+    total = comb(len(palette), num_members)
+    shard_size = max(1, min(MAX_SHARD_SIZE // max(len(grid), 1), -(-total // (workers * 4))))
+    shards = ((palette, num_members, start, min(start + shard_size, total), grid, collapsed, rules)
+              for start in range(0, total, shard_size))
+    _logger.debug('Formatting {} element sets in shards of {} on {} workers'.format(
+        total, shard_size, workers))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(_stoichiometry_shard, shard))
+            if len(pending) >= workers * 2:
+                yield from index.merge(*pending.popleft().result())
+        while pending:
+            yield from index.merge(*pending.popleft().result())
+
+
+def combination_at(pool_size: int, num_members: int, rank: int) -> List[int]:
+    """[Finds the indices of the rank-th combination in lexicographic order]
+
+    Arguments:
+        pool_size {int} -- [Number of elements to choose from]
+        num_members {int} -- [Number of elements in each combination]
+        rank {int} -- [Position of the combination as produced by itertools]
+
+    Returns:
+        List[int] -- [Element indices of the combination]
+    """
+    indices = []
+    start = 0
+    for slot in range(num_members):
+        remaining = num_members - slot - 1
+        for i in range(start, pool_size):
+            block = comb(pool_size - i - 1, remaining)
+            if rank < block:
+                indices.append(i)
+                start = i + 1
+                break
+            rank -= block
+    return indices
+
+
+def combinations_slice(elements: Iterable[str], num_members: int, start: int, stop: int) -> Iterator[Tuple[str, ...]]:
+    """[Generates combinations[start:stop] without producing the earlier ones]
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+        start {int} -- [Rank of the first combination]
+        stop {int} -- [Rank after the last combination]
+
+    Returns:
+        Iterator[Tuple[str, ...]] -- [The combinations in itertools order]
+    """
+    pool = tuple(elements)
+    pool_size = len(pool)
+    if start >= min(stop, comb(pool_size, num_members)):
+        return
+    indices = combination_at(pool_size, num_members, start)
+    for _ in range(start, stop):
+        yield tuple(pool[i] for i in indices)
+        for i in reversed(range(num_members)):
+            if indices[i] != i + pool_size - num_members:
+                break
+        else:
+            return
+        indices[i] += 1
+        for j in range(i + 1, num_members):
+            indices[j] = indices[j - 1] + 1
+
+
+def _init_worker(cache_size: Optional[int], cache_path: Optional[str]):
+    """[Gives a worker process its own read-only view of the formula cache]
+
+    Arguments:
+        cache_size {Optional[int]} -- [In-memory cache size, None disables caching]
+        cache_path {Optional[str]} -- [SQLite file of the parent cache]
+    """
+    global _worker_cache
+    if cache_size is not None:
+        _worker_cache = FormulaCache(maxsize=cache_size, path=cache_path, readonly=True)
+
+
+def _screen_shard(shard: Tuple[List[str], int, int, int, Sequence[Rule]]) -> Tuple[List[str], int, Optional[tuple]]:
+    """[Screens one slice of the combination space in a worker process]
+
+    Rules are checked on each complete combination of the slice, so rejected
+    candidates still skip the pymatgen reduction.
+
+    Arguments:
+        shard {Tuple[List[str], int, int, int, Sequence[Rule]]} -- [Elements, members, start and stop rank, rules]
+
+    Returns:
+        Tuple[List[str], int, Optional[tuple]] -- [Unique formulas of the slice, candidates screened and cache report]
+    """
+    elements, num_members, start, stop, rules = shard
+    index = FormulaIndex()
+    candidates = ("".join(x) for x in combinations_slice(elements, num_members, start, stop)
+                  if admits_all(rules, x))
+    formulas = list(iter_screened_formulas(candidates, index=index, cache=_worker_cache))
+    report = _worker_cache.drain() if _worker_cache is not None else None
+    return formulas, index.candidates, report
+
+
+def iter_formulas_parallel(elements: Iterable[str], num_members: int, workers: int, index: Optional[FormulaIndex] = None, shard_size: Optional[int] = None, cache: Optional[FormulaCache] = None, rules: Sequence[Rule] = ()) -> Iterator[str]:
+    """[Screens the combination space across a process pool]
+
+    The combination ranks are split into contiguous shards and the results
+    are merged in shard order, so the output matches the serial enumeration.
+    At most two shards per worker are in flight at a time. Workers read the
+    cache's SQLite file and hand their new entries back to the parent cache.
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+        workers {int} -- [Number of worker processes]
+
+    Keyword Arguments:
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        shard_size {Optional[int]} -- [Combinations screened per task] (default: {None})
+        cache {Optional[FormulaCache]} -- [Cache of previously reduced formulas] (default: {None})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
+
+    Returns:
+        Iterator[str] -- [Unique reduced formulas in enumeration order]
+    """
+    elements = list(elements)
+    rules = list(rules)
+    if index is None:
+        index = FormulaIndex()
+    total = comb(len(elements), num_members)
+    if not shard_size:
+        shard_size = max(1, min(MAX_SHARD_SIZE, -(-total // (workers * 4))))
+    shards = ((elements, num_members, start, min(start + shard_size, total), rules)
+              for start in range(0, total, shard_size))
+    _logger.debug('Screening {} combinations in shards of {} on {} workers'.format(
+        total, shard_size, workers))
+    if cache is not None:
+        cache.flush()
+        initargs = (cache.maxsize, cache.path)
+    else:
+        initargs = (None, None)
+
+    def merge(future):
+        formulas, candidates, report = future.result()
+        if report is not None and cache is not None:
+            cache.absorb(*report)
+        return index.merge(formulas, candidates)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(_screen_shard, shard))
+            if len(pending) >= workers * 2:
+                yield from merge(pending.popleft())
+        while pending:
+            yield from merge(pending.popleft())
+
+
+def screen_formulas(candidates: Iterable[str], index: Optional[FormulaIndex] = None, cache: Optional[FormulaCache] = None) -> Iterable[str]:
+    """[Filters unique chemical compositions]
+
+    Arguments:
+        candidates {Iterable[str]} -- [List of chemical formula candidates]
+
+    Keyword Arguments:
+        index {Optional[FormulaIndex]} -- [Index collecting the screening statistics] (default: {None})
+        cache {Optional[FormulaCache]} -- [Cache of previously reduced formulas] (default: {None})
+
+    Returns:
+        Iterable[str] -- [Filtered list of candidates]
+    """
+    return list(iter_screened_formulas(candidates, index=index, cache=cache))
+
+
 def parse_args(args):
     """Parse command line parameters
 
@@ -104,8 +477,16 @@ def parse_args(args):
         '-sfp',
         '--savefilepath',
         dest="save_filepath",
-        help="file path to save design space as CSV",
-        default="design_space.csv",
+        help="file path to save design space at, design_space.<format> by default",
+        default=None,
+        type=str)
+    parser.add_argument(
+        '-f',
+        '--format',
+        dest="output_format",
+        help="File format of the saved design space",
+        default='csv',
+        choices=sorted(EXTENSIONS),
         type=str)
     parser.add_argument(
         '-k',
@@ -142,6 +523,135 @@ def parse_args(args):
         help="Citrination dataset ID to store data at",
         default=None,
         type=str)
+    parser.add_argument(
+        '-pfp',
+        '--piffilepath',
+        dest="pif_filepath",
+        help="file path to keep the uploaded PIFs at, a temporary file by default",
+        default=None,
+        type=str)
+    parser.add_argument(
+        '-cpif',
+        '--compact-pif',
+        dest="pif_indent",
+        help="Write the uploaded PIFs without indentation",
+        default=2,
+        action='store_const',
+        const=None)
+    parser.add_argument(
+        '-sb',
+        '--shard-bytes',
+        dest="shard_bytes",
+        help="Upload the PIFs as shards of at most this many bytes",
+        default=None,
+        type=int)
+    parser.add_argument(
+        '-uw',
+        '--upload-workers',
+        dest="upload_workers",
+        help="Number of shards uploaded concurrently",
+        default=4,
+        type=int)
+    parser.add_argument(
+        '-mf',
+        '--manifest',
+        dest="manifest_path",
+        help="Manifest of a sharded upload; an unfinished one with the same inputs is resumed",
+        default=os.path.join('pif_shards', 'manifest.json'),
+        type=str)
+    parser.add_argument(
+        '-it',
+        '--ingest-timeout',
+        dest="ingest_timeout",
+        help="Seconds to wait for Citrination to ingest the upload",
+        default=600.0,
+        type=float)
+    parser.add_argument(
+        '-pi',
+        '--poll-interval',
+        dest="poll_interval",
+        help="Seconds before the first ingest status poll is repeated",
+        default=0.5,
+        type=float)
+    parser.add_argument(
+        '-st',
+        '--stream',
+        dest="stream",
+        help="Stream formulas to the output in chunks instead of building a list",
+        default=False,
+        action='store_true')
+    parser.add_argument(
+        '-cs',
+        '--chunksize',
+        dest="chunksize",
+        help="Number of formulas buffered per csv write",
+        default=10000,
+        type=int)
+    parser.add_argument(
+        '-gz',
+        '--gzip',
+        dest="compression",
+        help="Compress the csv with gzip",
+        default=None,
+        action='store_const',
+        const='gzip')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest="workers",
+        help="Number of processes used to screen formulas",
+        default=1,
+        type=int)
+    parser.add_argument(
+        '-mc',
+        '--max-coefficient',
+        dest="max_coefficient",
+        help="Sweep integer stoichiometries up to this coefficient",
+        default=None,
+        type=int)
+    parser.add_argument(
+        '-fs',
+        '--fraction-step',
+        dest="step",
+        help="Sweep fractional stoichiometries on a simplex with this step",
+        default=None,
+        type=float)
+    parser.add_argument(
+        '-cb',
+        '--charge-balanced',
+        dest="charge_balanced",
+        help="Only keep formulas that balance for common oxidation states",
+        default=False,
+        action='store_true')
+    parser.add_argument(
+        '-xp',
+        '--exclude-pair',
+        dest="excluded_pairs",
+        help="Element pair that may not appear together, as Na,Cl",
+        default=[],
+        action='append',
+        type=str)
+    parser.add_argument(
+        '-ens',
+        '--max-en-spread',
+        dest="max_spread",
+        help="Largest electronegativity difference within a formula",
+        default=None,
+        type=float)
+    parser.add_argument(
+        '-cz',
+        '--cache-size',
+        dest="cache_size",
+        help="Number of reduced formulas kept in the in-memory cache",
+        default=100000,
+        type=int)
+    parser.add_argument(
+        '-cp',
+        '--cache-path',
+        dest="cache_path",
+        help="SQLite file persisting reduced formulas across runs",
+        default=None,
+        type=str)
     parser.add_argument(
         '-v',
         '--verbose',
@@ -182,18 +692,62 @@ def setup_logging(loglevel):
                         format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
 
 
-def to_pif(data: Iterable[str]):
+def to_pif(data: Iterable[str], filepath: str = 'pifs.json', indent: Optional[int] = 2) -> int:
+    """[Streams the design space to a JSON array of PIF systems]
+
+    Systems are serialized one at a time, so only a single ChemicalSystem is
+    held in memory regardless of the size of the design space.
+
+    Arguments:
+        data {Iterable[str]} -- [The enumerated design space]
+
+    Keyword Arguments:
+        filepath {str} -- [The file path to save the PIFs at] (default: {'pifs.json'})
+        indent {Optional[int]} -- [JSON indentation, None for compact output] (default: {2})
+
+    Returns:
+        int -- [The number of systems written]
+    """
+    if indent is None:
+        options, separator, prefix = {'separators': (',', ':')}, ',', ''
+    else:
+        options, separator, prefix = {'indent': indent}, ',\n', ' ' * indent
+    count = 0
     try:
-        systems = [pypif.obj.ChemicalSystem(
-            chemical_formula=formula) for formula in data]
-        with open('pifs.json', 'w') as f:
-            pypif.pif.dump(systems, f, indent=2)
+        with open(filepath, 'w') as f:
+            f.write('[')
+            for formula in data:
+                system = pypif.obj.ChemicalSystem(chemical_formula=formula)
+                text = pypif.pif.dumps(system, **options)
+                if prefix:
+                    text = textwrap.indent(text, prefix)
+                f.write((separator if count else separator.lstrip(',')) + text)
+                count += 1
+            f.write(']' if indent is None or not count else '\n]')
     except Exception as exc:
         print('-- Could not generate PIF --')
         raise(exc)
+    return count
 
 
-def store_on_citrination(data: Iterable[str], dataset_id: str, site: str, api_string: str) -> str:
+def prepare_dataset(client: CitrinationClient, dataset_id: Optional[str]) -> str:
+    """[Creates a new dataset version, or a new dataset if it does not exist]
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        dataset_id {Optional[str]} -- [Citrination datset id to store data at]
+
+    Returns:
+        str -- [The Citrination dataset id to upload to]
+    """
+    try:
+        client.data.create_dataset_version(dataset_id)
+    except Exception as exc:
+        dataset_id = client.data.create_dataset().id
+    return dataset_id
+
+
+def store_on_citrination(data: Iterable[str], dataset_id: str, site: str, api_string: str, pif_filepath: Optional[str] = None, indent: Optional[int] = 2, shard_bytes: Optional[int] = None, upload_workers: int = 4, manifest_path: str = os.path.join('pif_shards', 'manifest.json'), ingest_timeout: Optional[float] = 600.0, poll_interval: float = 0.5) -> str:
     """[Handles storing data in a Citrination dataset]
     
     Arguments:
@@ -201,6 +755,15 @@ def store_on_citrination(data: Iterable[str], dataset_id: str, site: str, api_st
         dataset_id {str} -- [Citrination datset id to store data at]
         site {str} -- [Citrination site to store datset on]
         api_string {str} -- [The api key string in environment variables]
+
+    Keyword Arguments:
+        pif_filepath {Optional[str]} -- [Where to keep the PIFs, a removed temporary file if None] (default: {None})
+        indent {Optional[int]} -- [JSON indentation, None for compact output] (default: {2})
+        shard_bytes {Optional[int]} -- [Upload size-bounded shards of this many bytes] (default: {None})
+        upload_workers {int} -- [Number of concurrent shard uploads] (default: {4})
+        manifest_path {str} -- [Manifest of a sharded upload, resumed if unfinished] (default: {'pif_shards/manifest.json'})
+        ingest_timeout {Optional[float]} -- [Seconds to wait for ingestion, None waits forever] (default: {600.0})
+        poll_interval {float} -- [First pause between ingest status polls, doubled up to 30s] (default: {0.5})
     
     Returns:
         str -- [The Citrination dataset id]
@@ -211,48 +774,156 @@ def store_on_citrination(data: Iterable[str], dataset_id: str, site: str, api_st
         print('-- API key not found in environment variables --')
         raise(exc)
     client = CitrinationClient(api_key, site)
-    to_pif(data)
-    # create a new dataset version, if the dataset does not exist; create it.
-    try:
-        client.data.create_dataset_version(dataset_id)
-    except Exception as exc:
-        dataset_id = client.data.create_dataset().id
-    client.data.upload(dataset_id, 'pifs.json')
-    ready = False
-    while not ready:
-        status = client.data.get_ingest_status(dataset_id)
-        if status:
-            ready = True
-        else:
-            _logger.info('Citrination Ingestion Status: {}'.format(status))
+    if shard_bytes:
+        dataset_id = store_shards(client, data, dataset_id, shard_bytes, manifest_path, upload_workers, indent)
+    else:
+        dataset_id = store_file(client, data, dataset_id, pif_filepath, indent)
+    wait_for_ingest(client, dataset_id, Waiter(initial=poll_interval, timeout=ingest_timeout))
     return dataset_id
     # Build data upload here
 
 
-def handle_output_method(data: Iterable[str], store_citrination: bool, use_csv: bool, dataset_id: str,  site: str, api_string: str, filepath: str):
+def store_file(client: CitrinationClient, data: Iterable[str], dataset_id: Optional[str], pif_filepath: Optional[str] = None, indent: Optional[int] = 2) -> str:
+    """[Uploads the design space as a single PIF file]
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        data {Iterable[str]} -- [The enumerated design space]
+        dataset_id {Optional[str]} -- [Citrination datset id to store data at]
+
+    Keyword Arguments:
+        pif_filepath {Optional[str]} -- [Where to keep the PIFs, a removed temporary file if None] (default: {None})
+        indent {Optional[int]} -- [JSON indentation, None for compact output] (default: {2})
+
+    Returns:
+        str -- [The Citrination dataset id]
+    """
+    if pif_filepath is None:
+        handle, filepath = tempfile.mkstemp(prefix='pifs-', suffix='.json')
+        os.close(handle)
+    else:
+        filepath = pif_filepath
+    try:
+        to_pif(data, filepath, indent=indent)
+        # create a new dataset version, if the dataset does not exist; create it.
+        dataset_id = prepare_dataset(client, dataset_id)
+        dest_path = 'pifs.json' if pif_filepath is None else os.path.basename(pif_filepath)
+        client.data.upload(dataset_id, filepath, dest_path=dest_path)
+    finally:
+        if pif_filepath is None:
+            os.remove(filepath)
+    return dataset_id
+
+
+def store_shards(client: CitrinationClient, data: Iterable[str], dataset_id: Optional[str], shard_bytes: int, manifest_path: str, upload_workers: int = 4, indent: Optional[int] = 2) -> str:
+    """[Uploads the design space as size-bounded shards, resuming from a manifest]
+
+    An unfinished upload in the manifest is resumed without serializing the
+    design space again, provided it targets the same dataset with the same
+    shard settings and its formulas have the same digest. Otherwise a
+    ValueError is raised rather than uploading other data. A manifest whose
+    upload finished, or whose shards were never all written, is started
+    afresh.
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        data {Iterable[str]} -- [The enumerated design space]
+        dataset_id {Optional[str]} -- [Citrination datset id to store data at]
+        shard_bytes {int} -- [Size bound of each shard file]
+        manifest_path {str} -- [Manifest of the sharded upload]
+
+    Keyword Arguments:
+        upload_workers {int} -- [Number of concurrent shard uploads] (default: {4})
+        indent {Optional[int]} -- [JSON indentation, None for compact output] (default: {2})
+
+    Returns:
+        str -- [The Citrination dataset id]
+    """
+    manifest = UploadManifest(manifest_path)
+    settings = {'dataset_id': None if dataset_id is None else str(dataset_id),
+                'shard_bytes': shard_bytes, 'indent': indent}
+    if manifest.resumable:
+        if manifest.settings != settings or manifest.digest != data_digest(data):
+            raise ValueError('{} holds an unfinished upload of other data or settings; re-run it with the same '
+                             'inputs, or remove it to start a new upload'.format(manifest_path))
+        _logger.info('Resuming upload to dataset {} from {}'.format(manifest.dataset_id, manifest_path))
+    else:
+        if manifest.shards and not manifest.written:
+            _logger.info('Discarding the shards of an interrupted write in {}'.format(manifest_path))
+        manifest.reset(settings)
+        manifest.dataset_id = prepare_dataset(client, dataset_id)
+        write_pif_shards(data, manifest, shard_bytes, indent=indent)
+    upload_shards(client, manifest.dataset_id, manifest, workers=upload_workers)
+    manifest.mark_done()
+    return manifest.dataset_id
+
+
+def handle_output_method(data: Iterable[str], store_citrination: bool = False, use_csv: bool = True, dataset_id: Optional[str] = None,  site: str = "https://citrination.com", api_string: str = "CITRINATION_API_KEY", filepath: str = "design_space.csv", chunksize: int = 10000, compression: Optional[str] = None, output_format: str = 'csv', elements: Iterable[str] = (), pif_filepath: Optional[str] = None, pif_indent: Optional[int] = 2, shard_bytes: Optional[int] = None, upload_workers: int = 4, manifest_path: str = os.path.join('pif_shards', 'manifest.json'), ingest_timeout: Optional[float] = 600.0, poll_interval: float = 0.5) -> Optional[int]:
     """[Handles saving or uploading the enumerated design space]
     
     Arguments:
         data {Iterable[str]} -- [The enumerated design space]
-        store_citrination {bool} -- [Upload to the Citrination platform]
-        use_csv {bool} -- [Store using a csv file]
-        dataset_id {str} -- [Citrination datset id to store data at]
-        site {str} -- [Citrination site to store datset on]
-        api_string {str} -- [The api key string in environment variables]
-        filepath {str} -- [The file path to save the enumerated csv at]
+
+    Keyword Arguments:
+        store_citrination {bool} -- [Upload to the Citrination platform] (default: {False})
+        use_csv {bool} -- [Store in a local file] (default: {True})
+        dataset_id {Optional[str]} -- [Citrination datset id to store data at] (default: {None})
+        site {str} -- [Citrination site to store datset on] (default: {"https://citrination.com"})
+        api_string {str} -- [The api key string in environment variables] (default: {"CITRINATION_API_KEY"})
+        filepath {str} -- [The file path to save the design space at] (default: {"design_space.csv"})
+        chunksize {int} -- [Number of formulas buffered per write] (default: {10000})
+        compression {Optional[str]} -- [csv compression, None or 'gzip'] (default: {None})
+        output_format {str} -- [csv, parquet, arrow or feather] (default: {'csv'})
+        elements {Iterable[str]} -- [Palette elements given a fraction column in columnar formats, taken from the data if empty] (default: {()})
+        pif_filepath {Optional[str]} -- [Where to keep the uploaded PIFs] (default: {None})
+        pif_indent {Optional[int]} -- [PIF JSON indentation, None for compact output] (default: {2})
+        shard_bytes {Optional[int]} -- [Upload size-bounded shards of this many bytes] (default: {None})
+        upload_workers {int} -- [Number of concurrent shard uploads] (default: {4})
+        manifest_path {str} -- [Manifest of a sharded upload, resumed if unfinished] (default: {'pif_shards/manifest.json'})
+        ingest_timeout {Optional[float]} -- [Seconds to wait for ingestion, None waits forever] (default: {600.0})
+        poll_interval {float} -- [First pause between ingest status polls] (default: {0.5})
+
+    Returns:
+        Optional[int] -- [The number of formulas saved]
     """
     if use_csv:
         #filepath = str(os.path.join(filepath))
         _logger.debug("Save File Path: {}".format(filepath))
-        tabulated_data = pd.DataFrame(data=data, columns=['Chemical Formula'])
-        tabulated_data.to_csv(filepath, index=False)
+        if output_format != 'csv' and not elements and isinstance(data, list):
+            # A streamed design space is given the elements of its first chunk instead
+            elements = list(dict.fromkeys(element for formula in data for element in element_amounts(formula)))
+        with open_writer(filepath, output_format, chunksize=chunksize, compression=compression, elements=elements) as writer:
+            writer.write(data)
         _logger.info('Design Space Saved: {}'.format(filepath))
+        _logger.info('Wrote {} formulas in {:.2f}s ({:.0f} rows/s)'.format(
+            writer.rows, writer.elapsed, writer.rows_per_second))
+        return writer.rows
     elif store_citrination:
-        dataset_id = store_on_citrination(data, dataset_id, site=site, api_string=api_string)
+        dataset_id = store_on_citrination(data, dataset_id, site=site, api_string=api_string, pif_filepath=pif_filepath, indent=pif_indent, shard_bytes=shard_bytes, upload_workers=upload_workers, manifest_path=manifest_path, ingest_timeout=ingest_timeout, poll_interval=poll_interval)
         _logger.info(
             'Data Uploaded to Citrination Dataset ID: {}'.format(dataset_id))
 
 
+def log_screening_stats(index: FormulaIndex):
+    """[Logs how much screening collapsed the design space]
+
+    Arguments:
+        index {FormulaIndex} -- [The index populated during enumeration]
+    """
+    _logger.info('Screened {} candidates: {} unique formulas, {} duplicates removed'.format(
+        index.candidates, len(index), index.duplicates))
+
+
+def log_cache_stats(cache: FormulaCache):
+    """[Logs how often the formula cache avoided a pymatgen reduction]
+
+    Arguments:
+        cache {FormulaCache} -- [The cache used during enumeration]
+    """
+    _logger.info('Formula cache: {} hits, {} disk hits, {} misses'.format(
+        cache.hits, cache.disk_hits, cache.misses))
+
+
 def main(args):
     """Main entry point allowing external calls
 
@@ -267,12 +938,32 @@ def main(args):
         elements = extract_from_file(os.path.join(args.design_filepath))
     else:
         elements = args.elements
-    formulas = enumerate_formula(elements, args.num_elements)
-    handle_output_method(formulas, args.use_citrination, args.use_csv, args.dataset_id, args.site, args.api_string, args.save_filepath)
+    filepath = args.save_filepath or 'design_space.{}'.format(EXTENSIONS[args.output_format])
+    index = FormulaIndex()
+    rules = build_rules(args.charge_balanced, args.excluded_pairs, args.max_spread)
+    with FormulaCache(maxsize=args.cache_size, path=args.cache_path) as formula_cache:
+        # Stoichiometry grids are formatted already reduced and skip the cache
+        cache = None if args.max_coefficient or args.step else formula_cache
+        if args.stream:
+            formulas = enumerate_formula(elements, args.num_elements, stream=True, index=index, workers=args.workers, max_coefficient=args.max_coefficient, step=args.step, cache=cache, rules=rules)
+            rows = handle_output_method(formulas, args.use_citrination, args.use_csv, args.dataset_id, args.site, args.api_string, filepath, chunksize=args.chunksize, compression=args.compression, output_format=args.output_format, elements=elements, pif_filepath=args.pif_filepath, pif_indent=args.pif_indent, shard_bytes=args.shard_bytes, upload_workers=args.upload_workers, manifest_path=args.manifest_path, ingest_timeout=args.ingest_timeout, poll_interval=args.poll_interval)
+            _logger.info("Enumeration Ended")
+            log_screening_stats(index)
+            log_cache_stats(formula_cache)
+            if rows is not None:
+                _logger.info("{} formulas streamed".format(rows))
+            return
+        formulas = enumerate_formula(elements, args.num_elements, index=index, workers=args.workers, max_coefficient=args.max_coefficient, step=args.step, cache=cache, rules=rules)
+    handle_output_method(formulas, args.use_citrination, args.use_csv, args.dataset_id, args.site, args.api_string, filepath, chunksize=args.chunksize, compression=args.compression, output_format=args.output_format, elements=elements, pif_filepath=args.pif_filepath, pif_indent=args.pif_indent, shard_bytes=args.shard_bytes, upload_workers=args.upload_workers, manifest_path=args.manifest_path, ingest_timeout=args.ingest_timeout, poll_interval=args.poll_interval)
 
     _logger.info("Enumeration Ended")
-    _logger.info("Example of {} formulas generated: {}".format(
-        len(formulas), formulas[0]))
+    log_screening_stats(index)
+    log_cache_stats(formula_cache)
+    if formulas:
+        _logger.info("Example of {} formulas generated: {}".format(
+            len(formulas), formulas[0]))
+    else:
+        _logger.info("0 formulas generated")
 
 
 def run():
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Chemistry rules that prune the design space while it is being enumerated.
+
+A rule is any object with an ``admits(members)`` method returning whether an
+element set may appear in the design space. Rules whose ``partial`` attribute
+is true are also checked on incomplete element sets, which lets the
+enumerator skip every combination that extends a rejected prefix. Rules that
+define ``admits_amounts(members, grid)`` are judged on the coefficient
+vectors of a stoichiometry grid instead of on its element sets.
+"""
+
+import logging
+import math
+from itertools import product
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymatgen import Element
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+
+def comb(n: int, k: int) -> int:
+    """[Counts the ways to choose k of n items, like math.comb on Python 3.8+]
+
+    Arguments:
+        n {int} -- [Number of items]
+        k {int} -- [Number of items chosen]
+
+    Returns:
+        int -- [The binomial coefficient, 0 if k is out of range]
+    """
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n - k)
+    total = 1
+    for i in range(1, k + 1):
+        total = total * (n - k + i) // i
+    return total
+
+
+class Rule(object):
+    """[Base class of pruning rules admitting every element set]
+    """
+
+    # Whether admits() is meaningful for incomplete element sets
+    partial = True
+
+    def admits(self, members: Sequence[str]) -> bool:
+        """[Checks whether an element set may appear in the design space]
+
+        Arguments:
+            members {Sequence[str]} -- [Element symbols of the (partial) formula]
+
+        Returns:
+            bool -- [False if the element set should be pruned]
+        """
+        return True
+
+
+class ExcludedPairs(Rule):
+    """[Prunes element sets containing any of the given pairs]
+
+    Arguments:
+        pairs {Iterable[Tuple[str, str]]} -- [Element pairs that may not appear together]
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[str, str]]):
+        self.pairs = {frozenset(pair) for pair in pairs}
+
+    def admits(self, members: Sequence[str]) -> bool:
+        return not any(frozenset((first, second)) in self.pairs
+                       for i, first in enumerate(members)
+                       for second in members[i + 1:])
+
+
+class MaxElectronegativitySpread(Rule):
+    """[Prunes element sets whose Pauling electronegativities differ too much]
+
+    Elements without an electronegativity do not constrain the spread.
+
+    Arguments:
+        max_spread {float} -- [Largest allowed max(X) - min(X)]
+    """
+
+    def __init__(self, max_spread: float):
+        self.max_spread = max_spread
+        self._electronegativity = {}
+
+    def _x(self, symbol: str) -> float:
+        if symbol not in self._electronegativity:
+            self._electronegativity[symbol] = Element(symbol).X
+        return self._electronegativity[symbol]
+
+    def admits(self, members: Sequence[str]) -> bool:
+        values = [x for x in map(self._x, members) if not math.isnan(x)]
+        return not values or max(values) - min(values) <= self.max_spread
+
+
+class ChargeBalance(Rule):
+    """[Keeps formulas that balance for some choice of common oxidation states]
+
+    Equiatomic element sets are checked with unit amounts; stoichiometry grids
+    are checked row by row for every combination of oxidation states.
+    """
+
+    partial = False
+
+    def __init__(self):
+        self._states = {}
+
+    def states(self, symbol: str) -> Tuple[int, ...]:
+        """[Returns the common oxidation states of an element]
+
+        Arguments:
+            symbol {str} -- [Element symbol]
+
+        Returns:
+            Tuple[int, ...] -- [Common oxidation states]
+        """
+        if symbol not in self._states:
+            self._states[symbol] = tuple(Element(symbol).common_oxidation_states)
+        return self._states[symbol]
+
+    def admits(self, members: Sequence[str]) -> bool:
+        return any(sum(states) == 0 for states in product(*map(self.states, members)))
+
+    def admits_amounts(self, members: Sequence[str], grid: np.ndarray) -> np.ndarray:
+        """[Checks which coefficient vectors of an element set balance]
+
+        Arguments:
+            members {Sequence[str]} -- [Element symbols of each grid column]
+            grid {np.ndarray} -- [(n, len(members)) array of coefficients]
+
+        Returns:
+            np.ndarray -- [Boolean mask of the balanced rows]
+        """
+        mask = np.zeros(len(grid), dtype=bool)
+        for states in product(*map(self.states, members)):
+            mask |= grid @ np.array(states) == 0
+        return mask
+
+
+def admits_all(rules: Iterable[Rule], members: Sequence[str]) -> bool:
+    """[Checks a complete element set against every rule]
+
+    Arguments:
+        rules {Iterable[Rule]} -- [The pruning rules]
+        members {Sequence[str]} -- [Element symbols of the formula]
+
+    Returns:
+        bool -- [True if no rule rejects the element set]
+    """
+    return all(rule.admits(members) for rule in rules)
+
+
+def split_amount_rules(rules: Iterable[Rule]) -> Tuple[List[Rule], List[Rule]]:
+    """[Separates rules judged on element sets from rules judged on coefficients]
+
+    Arguments:
+        rules {Iterable[Rule]} -- [The pruning rules]
+
+    Returns:
+        Tuple[List[Rule], List[Rule]] -- [Element set rules and coefficient rules]
+    """
+    rules = list(rules)
+    return ([rule for rule in rules if not hasattr(rule, 'admits_amounts')],
+            [rule for rule in rules if hasattr(rule, 'admits_amounts')])
+
+
+def amounts_mask(rules: Iterable[Rule], members: Sequence[str], grid: np.ndarray) -> np.ndarray:
+    """[Combines the coefficient filters of every rule]
+
+    Arguments:
+        rules {Iterable[Rule]} -- [The pruning rules]
+        members {Sequence[str]} -- [Element symbols of each grid column]
+        grid {np.ndarray} -- [(n, len(members)) array of coefficients]
+
+    Returns:
+        np.ndarray -- [Boolean mask of the rows admitted by every rule]
+    """
+    mask = np.ones(len(grid), dtype=bool)
+    for rule in rules:
+        mask &= rule.admits_amounts(members, grid)
+    return mask
+
+
+def pruned_combinations(elements: Iterable[str], num_members: int, rules: Iterable[Rule]) -> Iterator[Tuple[str, ...]]:
+    """[Generates combinations in itertools order, skipping rejected subtrees]
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+        rules {Iterable[Rule]} -- [The pruning rules]
+
+    Returns:
+        Iterator[Tuple[str, ...]] -- [The admitted combinations]
+    """
+    pool = tuple(elements)
+    rules = list(rules)
+    partial_rules = [rule for rule in rules if getattr(rule, 'partial', False)]
+    complete_rules = [rule for rule in rules if not getattr(rule, 'partial', False)]
+
+    def extend(prefix: Tuple[str, ...], start: int) -> Iterator[Tuple[str, ...]]:
+        if len(prefix) == num_members:
+            if admits_all(complete_rules, prefix):
+                yield prefix
+            return
+        for i in range(start, len(pool) - (num_members - len(prefix)) + 1):
+            members = prefix + (pool[i],)
+            if admits_all(partial_rules, members):
+                yield from extend(members, i + 1)
+            else:
+                _logger.debug('Pruned element sets starting with {}'.format(members))
+
+    return extend((), 0)
+
+
+def build_rules(charge_balanced: bool = False, excluded_pairs: Iterable[str] = (), max_spread: Optional[float] = None) -> List[Rule]:
+    """[Builds the pruning rules requested on the command line]
+
+    Keyword Arguments:
+        charge_balanced {bool} -- [Require charge balance] (default: {False})
+        excluded_pairs {Iterable[str]} -- [Pairs written as Na,Cl] (default: {()})
+        max_spread {Optional[float]} -- [Largest electronegativity spread] (default: {None})
+
+    Returns:
+        List[Rule] -- [The pruning rules]
+    """
+    rules = []
+    if excluded_pairs:
+        rules.append(ExcludedPairs(
+            tuple(symbol.strip() for symbol in pair.split(',')) for pair in excluded_pairs))
+    if max_spread is not None:
+        rules.append(MaxElectronegativitySpread(max_spread))
+    if charge_balanced:
+        rules.append(ChargeBalance())
+    return rules
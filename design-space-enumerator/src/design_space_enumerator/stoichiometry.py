@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Vectorized enumeration of non-equiatomic compositions.
+
+Coefficient vectors are generated as NumPy grids and reduced by their
+greatest common divisor, so every surviving row is a distinct reduced
+formula for its element set and no pymatgen object is built per candidate.
+"""
+
+import logging
+import math
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymatgen import Element
+
+from design_space_enumerator.pruning import Rule, amounts_mask, comb, pruned_combinations, split_amount_rules
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+# Formulas pymatgen does not completely reduce (Composition.special_formulas)
+SPECIAL_FORMULAS = {'LiO': 'Li2O2', 'NaO': 'Na2O2', 'KO': 'K2O2', 'HO': 'H2O2', 'CsO': 'Cs2O2', 'RbO': 'Rb2O2',
+                    'O': 'O2', 'N': 'N2', 'F': 'F2', 'Cl': 'Cl2', 'H': 'H2'}
+
+
+def integer_grid(num_members: int, max_coefficient: int) -> np.ndarray:
+    """[Builds every primitive coefficient vector up to a maximum coefficient]
+
+    Vectors sharing a common factor (e.g. 2:2) reduce to a vector already in
+    the grid (1:1) and are dropped.
+
+    Arguments:
+        num_members {int} -- [The number of elements in the formula]
+        max_coefficient {int} -- [The largest coefficient of any element]
+
+    Returns:
+        np.ndarray -- [(n, num_members) array of integer coefficients]
+    """
+    axes = [np.arange(1, max_coefficient + 1)] * num_members
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, num_members)
+    return grid[np.gcd.reduce(grid, axis=1) == 1]
+
+
+def simplex_grid(num_members: int, step: float) -> np.ndarray:
+    """[Builds the reduced coefficient vectors of a fractional simplex grid]
+
+    Every point has fractions that are positive multiples of step summing to
+    one; each point is returned as its smallest integer ratio.
+
+    Arguments:
+        num_members {int} -- [The number of elements in the formula]
+        step {float} -- [The fractional grid spacing, e.g. 0.1]
+
+    Returns:
+        np.ndarray -- [(n, num_members) array of integer coefficients]
+    """
+    divisions = int(round(1 / step))
+    if divisions < 1 or not math.isclose(divisions * step, 1.0):
+        raise ValueError('The fractional step must divide 1, got {}'.format(step))
+    axes = [np.arange(1, divisions + 1)] * (num_members - 1)
+    if axes:
+        head = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, num_members - 1)
+    else:
+        head = np.empty((1, 0), dtype=int)
+    last = divisions - head.sum(axis=1)
+    grid = np.column_stack([head, last])[last >= 1]
+    return grid // np.gcd.reduce(grid, axis=1)[:, None]
+
+
+def coefficient_grid(num_members: int, max_coefficient: Optional[int] = None, step: Optional[float] = None) -> np.ndarray:
+    """[Builds the reduced coefficient vectors for one element set]
+
+    Arguments:
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Largest integer coefficient] (default: {None})
+        step {Optional[float]} -- [Fractional simplex spacing] (default: {None})
+
+    Returns:
+        np.ndarray -- [(n, num_members) array of integer coefficients]
+    """
+    if step:
+        return simplex_grid(num_members, step)
+    if max_coefficient:
+        return integer_grid(num_members, max_coefficient)
+    raise ValueError('Either a maximum coefficient or a fractional step is required')
+
+
+def raw_grid_size(num_members: int, max_coefficient: Optional[int] = None, step: Optional[float] = None) -> int:
+    """[Counts the coefficient vectors of a grid before reduction]
+
+    Arguments:
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Largest integer coefficient] (default: {None})
+        step {Optional[float]} -- [Fractional simplex spacing] (default: {None})
+
+    Returns:
+        int -- [Number of raw candidates per element set]
+    """
+    if step:
+        return comb(int(round(1 / step)) - 1, num_members - 1)
+    return max_coefficient ** num_members
+
+
+def electronegativity_order(elements: Iterable[str]) -> List[str]:
+    """[Orders element symbols the way pymatgen writes formulas]
+
+    Arguments:
+        elements {Iterable[str]} -- [Element symbols]
+
+    Returns:
+        List[str] -- [Symbols sorted by electronegativity, then symbol]
+    """
+    def key(symbol):
+        electronegativity = Element(symbol).X
+        return (math.inf if math.isnan(electronegativity) else electronegativity, symbol)
+    return sorted(elements, key=key)
+
+
+def _format_columns(symbols: List[str], grid: np.ndarray) -> np.ndarray:
+    amounts = np.where(grid == 1, '', grid.astype(str))
+    formulas = np.char.add(symbols[0], amounts[:, 0])
+    for column, symbol in enumerate(symbols[1:], start=1):
+        formulas = np.char.add(formulas, np.char.add(symbol, amounts[:, column]))
+    return formulas
+
+
+def format_formulas(symbols: List[str], grid: np.ndarray) -> List[str]:
+    """[Turns rows of coefficients into pymatgen reduced formula strings]
+
+    Rows are reduced by their greatest common divisor and written in
+    electronegativity order. As in Composition.reduced_formula, the two most
+    electronegative elements are grouped as a polyanion such as (CO3)2 when
+    they are close in electronegativity and share a factor, and formulas
+    like LiO are written as Li2O2.
+
+    Arguments:
+        symbols {List[str]} -- [Element symbol of each grid column]
+        grid {np.ndarray} -- [(n, len(symbols)) array of integer coefficients]
+
+    Returns:
+        List[str] -- [Formulas such as BaTiO3, omitting unit coefficients]
+    """
+    order = [list(symbols).index(symbol) for symbol in electronegativity_order(symbols)]
+    symbols = [symbols[column] for column in order]
+    grid = np.asarray(grid)[:, order]
+    grid = grid // np.gcd.reduce(grid, axis=1)[:, None]
+    formulas = _format_columns(symbols, grid)
+
+    if len(symbols) >= 3 and Element(symbols[-1]).X - Element(symbols[-2]).X < 1.65:
+        factor = np.gcd(grid[:, -2], grid[:, -1])
+        poly = factor > 1
+        if poly.any():
+            anion = _format_columns(symbols[-2:], grid[poly, -2:] // factor[poly, None])
+            anion = np.char.add(np.char.add('(', anion), np.char.add(')', factor[poly].astype(str)))
+            formulas = formulas.astype(object)
+            formulas[poly] = np.char.add(_format_columns(symbols[:-2], grid[poly, :-2]), anion)
+
+    formulas = formulas.tolist()
+    if len(symbols) <= 2:
+        formulas = [SPECIAL_FORMULAS.get(formula, formula) for formula in formulas]
+    return formulas
+
+
+def reduced_grid(num_members: int, max_coefficient: Optional[int] = None, step: Optional[float] = None) -> Tuple[np.ndarray, int]:
+    """[Builds the coefficient grid of an element set and counts the vectors it reduced away]
+
+    Arguments:
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Largest integer coefficient] (default: {None})
+        step {Optional[float]} -- [Fractional simplex spacing] (default: {None})
+
+    Returns:
+        Tuple[np.ndarray, int] -- [Reduced coefficient vectors and the number of raw vectors collapsed onto them]
+    """
+    grid = coefficient_grid(num_members, max_coefficient=max_coefficient, step=step)
+    collapsed = raw_grid_size(num_members, max_coefficient=max_coefficient, step=step) - len(grid)
+    _logger.debug('Stoichiometry grid has {} reduced vectors per element set'.format(len(grid)))
+    return grid, collapsed
+
+
+def grid_batches(symbol_sets: Iterable[Sequence[str]], grid: np.ndarray, collapsed: int, batch_size: int = 10000, amount_rules: Sequence[Rule] = ()) -> Iterator[Tuple[List[str], int]]:
+    """[Formats a coefficient grid over each element set in batches]
+
+    Arguments:
+        symbol_sets {Iterable[Sequence[str]]} -- [Element sets in electronegativity order]
+        grid {np.ndarray} -- [Reduced coefficient vectors]
+        collapsed {int} -- [Raw vectors per element set that reduced onto the grid]
+
+    Keyword Arguments:
+        batch_size {int} -- [Maximum formulas per batch] (default: {10000})
+        amount_rules {Sequence[Rule]} -- [Rules with a coefficient filter] (default: {()})
+
+    Returns:
+        Iterator[Tuple[List[str], int]] -- [Batches of unique reduced formulas and candidates screened]
+    """
+    for symbols in symbol_sets:
+        for start in range(0, len(grid), batch_size):
+            batch = grid[start:start + batch_size]
+            candidates = len(batch) + (collapsed if start + batch_size >= len(grid) else 0)
+            if amount_rules:
+                batch = batch[amounts_mask(amount_rules, symbols, batch)]
+            yield format_formulas(list(symbols), batch) if len(batch) else [], candidates
+
+
+def iter_stoichiometry_batches(elements: Iterable[str], num_members: int, max_coefficient: Optional[int] = None, step: Optional[float] = None, batch_size: int = 10000, rules: Sequence[Rule] = ()) -> Iterator[Tuple[List[str], int]]:
+    """[Lazily generates batches of reduced formulas over a stoichiometry grid]
+
+    Each batch is paired with the number of raw candidates it stands for,
+    the last batch of an element set also accounting for the vectors that
+    reduced onto another grid point. Element sets rejected by the rules are
+    skipped before any vector is formatted, and rules with a coefficient
+    filter drop the rows they reject from each batch.
+
+    Arguments:
+        elements {Iterable[str]} -- [Elements to build formulas from]
+        num_members {int} -- [The number of elements in the formula]
+
+    Keyword Arguments:
+        max_coefficient {Optional[int]} -- [Largest integer coefficient] (default: {None})
+        step {Optional[float]} -- [Fractional simplex spacing] (default: {None})
+        batch_size {int} -- [Maximum formulas per batch] (default: {10000})
+        rules {Sequence[Rule]} -- [Pruning rules applied while generating] (default: {()})
+
+    Returns:
+        Iterator[Tuple[List[str], int]] -- [Batches of unique reduced formulas and candidates screened]
+    """
+    palette = electronegativity_order(dict.fromkeys(elements))
+    grid, collapsed = reduced_grid(num_members, max_coefficient=max_coefficient, step=step)
+    set_rules, amount_rules = split_amount_rules(rules)
+    symbol_sets = pruned_combinations(palette, num_members, set_rules)
+    return grid_batches(symbol_sets, grid, collapsed, batch_size=batch_size, amount_rules=amount_rules)
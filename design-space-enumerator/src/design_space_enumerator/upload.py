@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sharded, resumable upload of the design space to Citrination.
+
+PIF systems are streamed into size-bounded JSON shards listed in a local
+manifest. Shards are uploaded through a bounded thread pool with retries,
+and the manifest records each finished shard so that re-running after a
+crash only sends the shards that are still missing. The manifest is keyed
+to the target dataset, the shard settings and a digest of the formulas, so
+an upload is only resumed with the same inputs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+import pypif
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+SHARD_NAME = 'pifs-{:05d}.json'
+
+
+def data_digest(data: Iterable[str]) -> str:
+    """[Fingerprints the formulas of a design space]
+
+    Arguments:
+        data {Iterable[str]} -- [The enumerated design space]
+
+    Returns:
+        str -- [SHA-256 hex digest of the formulas in order]
+    """
+    digest = hashlib.sha256()
+    for formula in data:
+        digest.update(formula.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+class UploadManifest(object):
+    """[Local record of the shards of an upload and which ones finished]
+
+    Arguments:
+        path {str} -- [The manifest JSON file; shards are kept next to it]
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.dataset_id = None
+        self.settings = None
+        self.digest = None
+        self.written = False
+        self.done = False
+        self.shards = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.dataset_id = state['dataset_id']
+            self.settings = state.get('settings')
+            self.digest = state.get('digest')
+            self.written = state.get('written', True)
+            self.done = state.get('done', False)
+            self.shards = state['shards']
+
+    @property
+    def pending(self) -> List[dict]:
+        return [shard for shard in self.shards if not shard['uploaded']]
+
+    @property
+    def resumable(self) -> bool:
+        """[Whether every shard was written and some are still to be uploaded]
+        """
+        return self.written and not self.done and bool(self.pending)
+
+    def reset(self, settings: dict):
+        """[Starts a new upload, forgetting the shards of the previous one]
+
+        Arguments:
+            settings {dict} -- [Target dataset and shard settings the upload is keyed to]
+        """
+        self.dataset_id = None
+        self.settings = settings
+        self.digest = None
+        self.written = False
+        self.done = False
+        self.shards = []
+
+    def save(self):
+        """[Atomically writes the manifest]
+        """
+        with self._lock:
+            state = {'dataset_id': self.dataset_id, 'settings': self.settings, 'digest': self.digest,
+                     'written': self.written, 'done': self.done, 'shards': self.shards}
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(temporary, self.path)
+
+    def mark_uploaded(self, shard: dict):
+        """[Records a finished shard]
+
+        Arguments:
+            shard {dict} -- [The manifest entry of the shard]
+        """
+        shard['uploaded'] = True
+        self.save()
+
+    def mark_done(self):
+        """[Records that every shard was uploaded, so the next upload starts afresh]
+        """
+        self.done = True
+        self.save()
+
+
+def write_pif_shards(data: Iterable[str], manifest: UploadManifest, max_bytes: int, indent: Optional[int] = None) -> List[dict]:
+    """[Streams the design space into JSON shards of at most max_bytes]
+
+    A shard always holds at least one system, so a single system larger than
+    max_bytes gets a shard of its own. The manifest is saved as each shard is
+    opened and finished, and records the digest of the formulas once every
+    shard is written.
+
+    Arguments:
+        data {Iterable[str]} -- [The enumerated design space]
+        manifest {UploadManifest} -- [The manifest listing the shards]
+        max_bytes {int} -- [Size bound of each shard file]
+
+    Keyword Arguments:
+        indent {Optional[int]} -- [JSON indentation, None for compact output] (default: {None})
+
+    Returns:
+        List[dict] -- [The manifest entries of the written shards]
+    """
+    options = {'separators': (',', ':')} if indent is None else {'indent': indent}
+    os.makedirs(manifest.directory, exist_ok=True)
+    handle, shard = None, None
+    digest = hashlib.sha256()
+    manifest.written = False
+    manifest.save()
+
+    def close_shard():
+        handle.write(']')
+        handle.close()
+        shard['bytes'] = os.path.getsize(os.path.join(manifest.directory, shard['path']))
+        manifest.save()
+
+    for formula in data:
+        digest.update(formula.encode('utf-8') + b'\n')
+        text = pypif.pif.dumps(pypif.obj.ChemicalSystem(chemical_formula=formula), **options)
+        if indent is not None:
+            text = textwrap.indent(text, ' ' * indent)
+        size = len(text.encode('utf-8')) + 2
+        if shard is not None and shard['systems'] and shard['bytes'] + size > max_bytes:
+            close_shard()
+            shard = None
+        if shard is None:
+            shard = {'path': SHARD_NAME.format(len(manifest.shards)), 'systems': 0, 'bytes': 1, 'uploaded': False}
+            manifest.shards.append(shard)
+            manifest.save()
+            handle = open(os.path.join(manifest.directory, shard['path']), 'w')
+            handle.write('[')
+        handle.write((',' if shard['systems'] else '') + text)
+        shard['systems'] += 1
+        shard['bytes'] += size
+    if shard is not None:
+        close_shard()
+    manifest.digest = digest.hexdigest()
+    manifest.written = True
+    manifest.save()
+    _logger.info('Wrote {} PIF shards to {}'.format(len(manifest.shards), manifest.directory))
+    return manifest.shards
+
+
+def upload_shard(client, dataset_id: str, manifest: UploadManifest, shard: dict, retries: int = 3, backoff: float = 1.0):
+    """[Uploads one shard, retrying failures with exponential backoff]
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        dataset_id {str} -- [Citrination datset id to store data at]
+        manifest {UploadManifest} -- [The manifest listing the shard]
+        shard {dict} -- [The manifest entry of the shard]
+
+    Keyword Arguments:
+        retries {int} -- [Attempts after the first failure] (default: {3})
+        backoff {float} -- [Seconds waited before the first retry, doubled after each] (default: {1.0})
+    """
+    source_path = os.path.join(manifest.directory, shard['path'])
+    for attempt in range(retries + 1):
+        try:
+            result = client.data.upload(dataset_id, source_path, dest_path=shard['path'])
+            if result.successful():
+                manifest.mark_uploaded(shard)
+                _logger.debug('Uploaded shard {}'.format(shard['path']))
+                return
+            error = RuntimeError('Upload of {} was not successful'.format(shard['path']))
+        except Exception as exc:
+            error = exc
+        if attempt < retries:
+            delay = backoff * 2 ** attempt
+            _logger.info('Retrying shard {} in {:.1f}s: {}'.format(shard['path'], delay, error))
+            time.sleep(delay)
+    raise error
+
+
+def upload_shards(client, dataset_id: str, manifest: UploadManifest, workers: int = 4, retries: int = 3, backoff: float = 1.0) -> int:
+    """[Uploads every pending shard of a manifest through a bounded thread pool]
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        dataset_id {str} -- [Citrination datset id to store data at]
+        manifest {UploadManifest} -- [The manifest listing the shards]
+
+    Keyword Arguments:
+        workers {int} -- [Number of concurrent uploads] (default: {4})
+        retries {int} -- [Attempts after the first failure of a shard] (default: {3})
+        backoff {float} -- [Seconds waited before the first retry, doubled after each] (default: {1.0})
+
+    Returns:
+        int -- [The number of shards uploaded]
+    """
+    pending = manifest.pending
+    _logger.info('Uploading {} of {} PIF shards'.format(len(pending), len(manifest.shards)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(upload_shard, client, dataset_id, manifest, shard, retries, backoff)
+                   for shard in pending]
+    failed = [shard['path'] for shard, future in zip(pending, futures) if future.exception()]
+    if failed:
+        raise RuntimeError('Could not upload shards {}; re-run to resume from {}'.format(
+            ', '.join(failed), manifest.path))
+    return len(pending)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Polling with exponential backoff, jitter, a deadline and cancellation.
+"""
+
+import logging
+import random
+import time
+from typing import Any, Callable, Optional
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+
+class WaitCancelled(Exception):
+    """[Raised when the cancellation hook of a Waiter fires]
+    """
+
+
+class Waiter(object):
+    """[Polls a status until it is done, sleeping longer between each poll]
+
+    The first poll happens immediately. Each following pause grows by factor
+    up to maximum and is spread by +/- jitter to avoid synchronized clients.
+    The clock, sleep and random functions can be swapped out for testing.
+
+    Keyword Arguments:
+        initial {float} -- [First pause in seconds] (default: {0.5})
+        maximum {float} -- [Longest pause in seconds] (default: {30.0})
+        factor {float} -- [Growth of the pause after each poll] (default: {2.0})
+        jitter {float} -- [Relative spread of each pause] (default: {0.1})
+        timeout {Optional[float]} -- [Seconds before giving up, None waits forever] (default: {600.0})
+        cancelled {Optional[Callable[[], bool]]} -- [Hook that aborts the wait when it returns True] (default: {None})
+    """
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30.0, factor: float = 2.0, jitter: float = 0.1,
+                 timeout: Optional[float] = 600.0, cancelled: Optional[Callable[[], bool]] = None,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic,
+                 rng: Callable[[], float] = random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.timeout = timeout
+        self.cancelled = cancelled
+        self._sleep = sleep
+        self._clock = clock
+        self._rng = rng
+        self.polls = 0
+        self.latency = 0.0
+        self.total_polls = 0
+        self.total_latency = 0.0
+
+    def wait(self, check: Callable[[], Any], done: Callable[[Any], bool] = bool) -> Any:
+        """[Polls check until done accepts its result]
+
+        Arguments:
+            check {Callable[[], Any]} -- [Fetches the current status]
+
+        Keyword Arguments:
+            done {Callable[[Any], bool]} -- [Decides whether a status is final] (default: {bool})
+
+        Raises:
+            TimeoutError -- [The deadline passed before the status was final]
+            WaitCancelled -- [The cancellation hook fired]
+
+        Returns:
+            Any -- [The final status]
+        """
+        started = self._clock()
+        deadline = None if self.timeout is None else started + self.timeout
+        delay = self.initial
+        self.polls = 0
+        try:
+            while True:
+                if self.cancelled is not None and self.cancelled():
+                    raise WaitCancelled('Wait cancelled after {} polls'.format(self.polls))
+                status = check()
+                self.polls += 1
+                if done(status):
+                    return status
+                pause = delay * (1 + self.jitter * (2 * self._rng() - 1))
+                if deadline is not None:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise TimeoutError('Status still {!r} after {} polls in {:.1f}s'.format(
+                            status, self.polls, self._clock() - started))
+                    pause = min(pause, remaining)
+                self._sleep(pause)
+                delay = min(delay * self.factor, self.maximum)
+        finally:
+            self.latency = self._clock() - started
+            self.total_polls += self.polls
+            self.total_latency += self.latency
+
+
+# Ingest statuses reported by Citrination once ingestion has stopped
+INGEST_FINISHED = 'Finished'
+INGEST_FAILED = ('Failed', 'Error')
+
+
+def wait_for_ingest(client, dataset_id: str, waiter: Optional[Waiter] = None) -> str:
+    """[Waits until Citrination has finished ingesting a dataset]
+
+    Arguments:
+        client {CitrinationClient} -- [The Citrination client]
+        dataset_id {str} -- [Citrination datset id being ingested]
+
+    Keyword Arguments:
+        waiter {Optional[Waiter]} -- [Polling policy, a default Waiter if None] (default: {None})
+
+    Raises:
+        RuntimeError -- [Ingestion failed]
+
+    Returns:
+        str -- [The final ingest status]
+    """
+    waiter = waiter or Waiter()
+
+    def check():
+        status = client.data.get_ingest_status(dataset_id)
+        _logger.debug('Citrination Ingestion Status: {}'.format(status))
+        if status in INGEST_FAILED:
+            raise RuntimeError('Ingestion of dataset {} ended with status {}'.format(dataset_id, status))
+        return status
+
+    status = waiter.wait(check, lambda status: status == INGEST_FINISHED)
+    _logger.info('Ingestion of dataset {} finished after {} polls in {:.1f}s'.format(
+        dataset_id, waiter.polls, waiter.latency))
+    return status
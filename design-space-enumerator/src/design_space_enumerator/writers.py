@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental writers for the enumerated design space.
+"""
+
+import abc
+import csv
+import gzip
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+_logger = logging.getLogger(__name__)
+
+FORMULA_COLUMN = 'Chemical Formula'
+COUNT_COLUMN = 'Number of Elements'
+
+# File extension of each supported output format
+EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'arrow': 'arrow', 'feather': 'feather'}
+
+_TOKEN = re.compile(r'([A-Z][a-z]*)([\d.]*)|(\()|(\))([\d.]*)')
+
+
+def element_amounts(formula: str) -> Dict[str, float]:
+    """[Parses a formula, including parenthesised groups, into element amounts]
+
+    Arguments:
+        formula {str} -- [A chemical formula such as Ba(TiO3)2]
+
+    Returns:
+        Dict[str, float] -- [Amount of each element]
+    """
+    stack = [defaultdict(float)]
+    for element, amount, group_open, group_close, multiplier in _TOKEN.findall(formula):
+        if element:
+            stack[-1][element] += float(amount or 1)
+        elif group_open:
+            stack.append(defaultdict(float))
+        elif group_close:
+            group = stack.pop()
+            for symbol, value in group.items():
+                stack[-1][symbol] += value * float(multiplier or 1)
+    return dict(stack[0])
+
+
+def fraction_column(element: str) -> str:
+    """[Names the column holding the atomic fraction of an element]
+
+    Arguments:
+        element {str} -- [Element symbol]
+
+    Returns:
+        str -- [The column name]
+    """
+    return 'Fraction {}'.format(element)
+
+
+class ChunkedWriter(abc.ABC):
+    """[Buffers formulas and hands them to a file format one chunk at a time]
+
+    Rows are buffered until a chunk is full, so output starts as soon as the
+    first chunk has been enumerated and memory is bounded by the chunk size.
+
+    Arguments:
+        filepath {str} -- [The file path to save the design space at]
+        chunksize {int} -- [Number of formulas buffered per write] (default: {10000})
+    """
+
+    def __init__(self, filepath: str, chunksize: int = 10000):
+        self.filepath = filepath
+        self.chunksize = chunksize
+        self.rows = 0
+        self._buffer = []
+        self._started = time.perf_counter()
+
+    @abc.abstractmethod
+    def _write_chunk(self, formulas: List[str]):
+        """[Writes one chunk of formulas to the file]
+        """
+
+    @abc.abstractmethod
+    def _close(self):
+        """[Closes the file]
+        """
+
+    def append(self, formula: str):
+        """[Buffers one formula, writing the chunk once it is full]
+
+        Arguments:
+            formula {str} -- [A reduced chemical formula]
+        """
+        self._buffer.append(formula)
+        if len(self._buffer) >= self.chunksize:
+            self.flush()
+
+    def write(self, formulas: Iterable[str]) -> int:
+        """[Buffers and writes every formula of an iterable]
+
+        Arguments:
+            formulas {Iterable[str]} -- [The enumerated design space]
+
+        Returns:
+            int -- [The number of formulas written so far]
+        """
+        for formula in formulas:
+            self.append(formula)
+        return self.rows + len(self._buffer)
+
+    def flush(self):
+        """[Writes the buffered chunk]
+        """
+        if self._buffer:
+            self._write_chunk(self._buffer)
+            self.rows += len(self._buffer)
+            self._buffer = []
+            _logger.debug('Wrote {} formulas to {}'.format(self.rows, self.filepath))
+
+    def close(self):
+        """[Writes the last chunk and closes the file, even if the chunk cannot be written]
+        """
+        try:
+            self.flush()
+        finally:
+            self._close()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else float('inf')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Keep the exception that is already propagating
+        try:
+            self.close()
+        except Exception as exc:
+            _logger.debug('Could not write the last chunk of {}: {}'.format(self.filepath, exc))
+
+
+class ChunkedCSVWriter(ChunkedWriter):
+    """[Appends formulas to a csv in fixed-size chunks as they are produced]
+
+    Arguments:
+        filepath {str} -- [The file path to save the enumerated csv at]
+        chunksize {int} -- [Number of formulas buffered per write] (default: {10000})
+        compression {Optional[str]} -- [None or 'gzip'; inferred from a .gz suffix] (default: {None})
+    """
+
+    def __init__(self, filepath: str, chunksize: int = 10000, compression: Optional[str] = None):
+        if compression is None and filepath.endswith('.gz'):
+            compression = 'gzip'
+        if compression not in (None, 'gzip'):
+            raise ValueError('Unsupported compression: {}'.format(compression))
+        super().__init__(filepath, chunksize=chunksize)
+        self.compression = compression
+        if compression == 'gzip':
+            self._handle = gzip.open(filepath, 'wt', newline='')
+        else:
+            self._handle = open(filepath, 'w', newline='')
+        self._writer = csv.writer(self._handle, lineterminator='\n')
+        self._writer.writerow([FORMULA_COLUMN])
+
+    def _write_chunk(self, formulas: List[str]):
+        self._writer.writerows((formula,) for formula in formulas)
+
+    def _close(self):
+        self._handle.close()
+
+
+class ColumnarWriter(ChunkedWriter):
+    """[Writes formulas with element counts and atomic fractions in a columnar layout]
+
+    Each chunk becomes a Parquet row group or an Arrow record batch holding
+    the formula, its number of elements and one atomic fraction column per
+    palette element. The arrow and feather formats are uncompressed Arrow IPC
+    files that can be memory-mapped.
+
+    The schema is fixed when the file is opened. Without a palette the file
+    is opened at the first chunk with a column for each element in it, so
+    every element of the design space should be in the first chunk or the
+    palette; a formula with any other element raises a ValueError.
+
+    Arguments:
+        filepath {str} -- [The file path to save the design space at]
+        elements {Iterable[str]} -- [Palette elements given a fraction column, taken from the first chunk if empty]
+        output_format {str} -- [parquet, arrow or feather] (default: {'parquet'})
+        chunksize {int} -- [Number of formulas buffered per write] (default: {10000})
+    """
+
+    def __init__(self, filepath: str, elements: Iterable[str] = (), output_format: str = 'parquet', chunksize: int = 10000):
+        if pa is None:
+            raise ImportError('pyarrow is required to write {} files'.format(output_format))
+        if output_format not in ('parquet', 'arrow', 'feather'):
+            raise ValueError('Unsupported columnar format: {}'.format(output_format))
+        super().__init__(filepath, chunksize=chunksize)
+        self.output_format = output_format
+        self.elements = list(dict.fromkeys(
+            symbol for entry in elements for symbol in element_amounts(entry.strip())))
+        self.schema = None
+        self._writer = None
+        if self.elements:
+            self._open(self.elements)
+
+    def _open(self, elements: List[str]):
+        self.elements = elements
+        self._columns = {element: i for i, element in enumerate(elements)}
+        self.schema = pa.schema(
+            [(FORMULA_COLUMN, pa.string()), (COUNT_COLUMN, pa.int32())] +
+            [(fraction_column(element), pa.float64()) for element in elements])
+        if self.output_format == 'parquet':
+            self._writer = pq.ParquetWriter(self.filepath, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(self.filepath, self.schema)
+
+    def _write_chunk(self, formulas: List[str]):
+        parsed_formulas = [element_amounts(formula) for formula in formulas]
+        if self._writer is None:
+            self._open(list(dict.fromkeys(element for parsed in parsed_formulas for element in parsed)))
+        counts = np.zeros(len(formulas), dtype=np.int32)
+        amounts = np.zeros((len(formulas), len(self.elements)))
+        for row, parsed in enumerate(parsed_formulas):
+            counts[row] = len(parsed)
+            for element, amount in parsed.items():
+                column = self._columns.get(element)
+                if column is None:
+                    raise ValueError('{} has element {}, which has no column in {}; pass every element of the '
+                                     'design space as the palette'.format(formulas[row], element, self.filepath))
+                amounts[row, column] = amount
+        fractions = amounts / amounts.sum(axis=1, keepdims=True)
+        arrays = [pa.array(formulas, pa.string()), pa.array(counts)] + \
+            [pa.array(fractions[:, i]) for i in range(len(self.elements))]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.output_format == 'parquet':
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+
+    def _close(self):
+        if self._writer is None:
+            self._open([])
+        self._writer.close()
+
+
+def open_writer(filepath: str, output_format: str = 'csv', chunksize: int = 10000, compression: Optional[str] = None, elements: Iterable[str] = ()) -> ChunkedWriter:
+    """[Opens the incremental writer of an output format]
+
+    Arguments:
+        filepath {str} -- [The file path to save the design space at]
+
+    Keyword Arguments:
+        output_format {str} -- [csv, parquet, arrow or feather] (default: {'csv'})
+        chunksize {int} -- [Number of formulas buffered per write] (default: {10000})
+        compression {Optional[str]} -- [csv compression, None or 'gzip'] (default: {None})
+        elements {Iterable[str]} -- [Palette elements given a fraction column] (default: {()})
+
+    Returns:
+        ChunkedWriter -- [The open writer]
+    """
+    if output_format == 'csv':
+        return ChunkedCSVWriter(filepath, chunksize=chunksize, compression=compression)
+    return ColumnarWriter(filepath, elements, output_format=output_format, chunksize=chunksize)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from design_space_enumerator.cache import *
+from design_space_enumerator.main import FormulaIndex, enumerate_formula
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+
+def test_cache_counts_hits_and_misses():
+    cache = FormulaCache(maxsize=1)
+    assert cache.reduced_formula('Ba2O2') == 'BaO'
+    assert cache.reduced_formula('Ba2O2') == 'BaO'
+    cache.reduced_formula('TiO2')
+    cache.reduced_formula('Ba2O2')
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert len(cache) == 1
+
+
+def test_cache_persists_to_sqlite(tmp_path):
+    path = str(tmp_path / 'formulas.sqlite')
+    with FormulaCache(path=path) as cache:
+        enumerate_formula(['Ba', 'Ti', 'O'], 2, cache=cache)
+        assert cache.misses == 3
+    with FormulaCache(path=path) as cache:
+        assert enumerate_formula(['Ba', 'Ti', 'O'], 2, cache=cache) == \
+            enumerate_formula(['Ba', 'Ti', 'O'], 2)
+        assert (cache.disk_hits, cache.misses) == (3, 0)
+
+
+def test_parallel_workers_report_to_parent_cache(tmp_path):
+    path = str(tmp_path / 'formulas.sqlite')
+    with FormulaCache(path=path) as cache:
+        formulas = enumerate_formula(['Ba', 'Ti', 'O', 'Sr'], 2, workers=2, cache=cache)
+        assert formulas == enumerate_formula(['Ba', 'Ti', 'O', 'Sr'], 2)
+        assert cache.misses == 6
+    with FormulaCache(path=path) as cache:
+        enumerate_formula(['Ba', 'Ti', 'O', 'Sr'], 2, workers=2, cache=cache)
+        assert (cache.disk_hits, cache.misses) == (6, 0)
@@ -25,3 +25,137 @@ def test_handle_output_to_csv():
 
 def test_extract_from_file():
     assert 'BaO' in extract_from_file('test_import.csv')
+
+
+def test_enumerate_formula_stream():
+    formulas = enumerate_formula(['Ba', 'Ti', 'O'], 2, stream=True)
+    assert not isinstance(formulas, list)
+    assert list(formulas) == enumerate_formula(['Ba', 'Ti', 'O'], 2)
+
+
+def test_handle_output_to_csv_in_chunks(tmp_path):
+    chunked_path = str(tmp_path / 'chunked_output.csv')
+    formulas = enumerate_formula(['Ba', 'Ti', 'O'], 2, stream=True)
+    rows = handle_output_method(formulas, False, True, None, None, None,
+                                chunked_path, chunksize=2)
+    assert rows == 3
+    assert pd.read_csv(chunked_path)['Chemical Formula'].tolist() == \
+        enumerate_formula(['Ba', 'Ti', 'O'], 2)
+
+
+def test_screen_formulas_counts_duplicates():
+    index = FormulaIndex()
+    formulas = screen_formulas(['BaO', 'Ba2O2', 'TiO2', 'OBa'], index=index)
+    assert formulas == ['BaO', 'TiO2']
+    assert list(index) == formulas
+    assert index.candidates == 4
+    assert index.duplicates == 2
+
+
+def test_combinations_slice_matches_itertools():
+    elements = ['Ba', 'Ti', 'O', 'Sr', 'Zr']
+    expected = list(combinations(elements, 3))
+    for start in range(len(expected)):
+        for stop in range(start, len(expected) + 2):
+            assert list(combinations_slice(elements, 3, start, stop)) == \
+                expected[start:stop]
+
+
+def test_enumerate_formula_parallel_matches_serial():
+    elements = ['Ba', 'Ti', 'O', 'Sr', 'Zr', 'O']
+    serial_index, parallel_index = FormulaIndex(), FormulaIndex()
+    serial = enumerate_formula(elements, 2, index=serial_index)
+    parallel = list(iter_formulas_parallel(elements, 2, 2, index=parallel_index,
+                                           shard_size=4))
+    assert parallel == serial
+    assert parallel == enumerate_formula(elements, 2, workers=2)
+    assert parallel_index.candidates == serial_index.candidates
+    assert parallel_index.duplicates == serial_index.duplicates
+
+
+def test_enumerate_formula_stoichiometry_grid():
+    index = FormulaIndex()
+    formulas = enumerate_formula(['Ba', 'Ti', 'O'], 3, index=index, step=0.2)
+    assert 'BaTiO3' in formulas
+    assert len(formulas) == len(index) == 6
+
+
+@pytest.mark.parametrize('indent', [2, None])
+def test_to_pif_streams_json_array(tmp_path, indent):
+    import json
+    filepath = str(tmp_path / 'pifs.json')
+    assert to_pif(iter(data), filepath, indent=indent) == 2
+    with open(filepath) as f:
+        text = f.read()
+    expected = pypif.pif.dumps(
+        [pypif.obj.ChemicalSystem(chemical_formula=formula) for formula in data],
+        **({'indent': indent} if indent else {'separators': (',', ':')}))
+    assert text == expected
+    assert [system['chemicalFormula'] for system in json.loads(text)] == data
+
+
+def test_to_pif_empty(tmp_path):
+    filepath = str(tmp_path / 'pifs.json')
+    assert to_pif([], filepath) == 0
+    with open(filepath) as f:
+        assert f.read() == '[]'
+
+
+def test_stoichiometry_workers_match_serial():
+    elements = ['Ba', 'Ti', 'O', 'Sr', 'Li']
+    serial = enumerate_formula(elements, 3, max_coefficient=3)
+    index = FormulaIndex()
+    parallel = enumerate_formula(elements, 3, max_coefficient=3, workers=2, index=index)
+    assert parallel == serial
+    assert index.candidates == comb(len(elements), 3) * 3 ** 3
+
+
+def test_stoichiometry_rejects_formula_cache():
+    with pytest.raises(ValueError):
+        enumerate_formula(['Ba', 'O'], 2, max_coefficient=2, cache=FormulaCache())
+
+
+def test_handle_output_to_parquet_without_palette(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    filepath = str(tmp_path / 'design_space.parquet')
+    rows = handle_output_method(['BaO', 'TiO2', 'SrO'], filepath=filepath, output_format='parquet', chunksize=2)
+    assert rows == 3
+    assert pq.read_table(filepath).column('Fraction Sr').to_pylist() == [0.0, 0.0, 0.5]
+
+
+class FakeShardClient(object):
+    def __init__(self):
+        self.data = self
+        self.uploaded = []
+        self.versions = []
+
+    def create_dataset_version(self, dataset_id):
+        self.versions.append(dataset_id)
+
+    def upload(self, dataset_id, source_path, dest_path=None):
+        self.uploaded.append((dataset_id, dest_path))
+        return type('Result', (), {'successful': lambda self: True})()
+
+
+def test_store_shards_keys_manifest_to_inputs(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    client = FakeShardClient()
+    assert store_shards(client, ['BaO', 'TiO2'], 7, 1, path) == 7
+    assert len(client.uploaded) == 2
+
+    # A finished upload is not resumed: the new data goes to the new dataset
+    client = FakeShardClient()
+    assert store_shards(client, ['SrO'], 8, 1, path) == 8
+    assert client.uploaded == [(8, 'pifs-00000.json')]
+
+    # An unfinished upload is only resumed with the same inputs
+    manifest = UploadManifest(path)
+    manifest.done = False
+    manifest.shards[0]['uploaded'] = False
+    manifest.save()
+    with pytest.raises(ValueError):
+        store_shards(FakeShardClient(), ['ZrO2'], 8, 1, path)
+    client = FakeShardClient()
+    assert store_shards(client, ['SrO'], 8, 1, path) == 8
+    assert client.uploaded == [(8, 'pifs-00000.json')]
+    assert client.versions == []
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+from itertools import combinations
+from design_space_enumerator.pruning import *
+from design_space_enumerator.main import enumerate_formula, main
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+elements = ['Na', 'K', 'Cl', 'O', 'Ba']
+
+
+@pytest.mark.parametrize('num_members', range(7))
+def test_comb_counts_combinations(num_members):
+    assert comb(len(elements), num_members) == len(list(combinations(elements, num_members)))
+
+
+def test_pruned_combinations_without_rules_match_itertools():
+    assert list(pruned_combinations(elements, 3, [])) == list(combinations(elements, 3))
+
+
+def test_excluded_pairs_prune_subtrees():
+    rule = ExcludedPairs([('Na', 'K')])
+    combos = list(pruned_combinations(elements, 3, [rule]))
+    assert combos == [x for x in combinations(elements, 3)
+                      if not {'Na', 'K'} <= set(x)]
+
+
+def test_max_electronegativity_spread():
+    rule = MaxElectronegativitySpread(1.0)
+    assert rule.admits(('Na', 'K'))
+    assert not rule.admits(('Na', 'Cl'))
+
+
+def test_charge_balance():
+    rule = ChargeBalance()
+    assert rule.admits(('Na', 'Cl'))
+    assert not rule.admits(('Na', 'O'))
+    grid = np.array([[1, 1], [2, 1]])
+    assert rule.admits_amounts(('Na', 'O'), grid).tolist() == [False, True]
+
+
+def test_enumerate_formula_applies_rules():
+    rules = build_rules(charge_balanced=True, excluded_pairs=['K,Cl'])
+    formulas = enumerate_formula(elements, 2, rules=rules)
+    assert formulas == ['NaCl', 'BaO']
+    assert enumerate_formula(elements, 2, rules=rules, workers=2) == formulas
+    assert 'Na2O' in enumerate_formula(elements, 2, rules=rules, max_coefficient=2)
+
+
+def test_main_writes_empty_design_space_when_everything_is_pruned(tmp_path):
+    filepath = str(tmp_path / 'design_space.csv')
+    main(['-e', 'Na', '-e', 'K', '-n', '2', '-cb', '-sfp', filepath])
+    with open(filepath) as f:
+        assert f.read().splitlines() == ['Chemical Formula']
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from itertools import combinations
+from pymatgen import Composition
+from design_space_enumerator.stoichiometry import *
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+
+def test_integer_grid_is_primitive():
+    grid = integer_grid(2, 4)
+    assert len(grid) == 11
+    assert [2, 2] not in grid.tolist()
+    assert [1, 3] in grid.tolist()
+
+
+def test_simplex_grid_reduces_fractions():
+    grid = simplex_grid(3, 0.2)
+    assert len(grid) == raw_grid_size(3, step=0.2) == 6
+    assert [1, 1, 3] in grid.tolist()
+
+
+def test_simplex_grid_rejects_uneven_step():
+    with pytest.raises(ValueError):
+        simplex_grid(2, 0.3)
+
+
+def test_batches_match_pymatgen_reduction():
+    formulas = [formula
+                for batch, _ in iter_stoichiometry_batches(['O', 'Ti', 'Ba'], 3, max_coefficient=3, batch_size=4)
+                for formula in batch]
+    assert 'BaTiO3' in formulas
+    reduced = [Composition(formula).reduced_formula for formula in formulas]
+    assert len(set(reduced)) == len(formulas)
+    assert len(formulas) == len(integer_grid(3, 3))
+
+
+def test_batches_count_raw_candidates():
+    batches = list(iter_stoichiometry_batches(['Ba', 'O', 'Ti'], 2, max_coefficient=2, batch_size=2))
+    assert sum(candidates for _, candidates in batches) == 3 * 4
+    assert sum(len(batch) for batch, _ in batches) == 3 * 3
+
+
+@pytest.mark.parametrize('elements', [['Li', 'O'], ['H', 'O'], ['Cs', 'O'], ['Ba', 'C', 'O'], ['Na', 'S', 'O', 'H']])
+def test_formulas_match_pymatgen_reduced_formula(elements):
+    for num_members in range(1, len(elements) + 1):
+        for grid in (integer_grid(num_members, 4), simplex_grid(num_members, 0.125)):
+            for symbols in combinations(elements, num_members):
+                expected = [Composition(dict(zip(symbols, row.tolist()))).reduced_formula for row in grid]
+                assert format_formulas(list(symbols), grid) == expected
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from design_space_enumerator.upload import *
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+
+class FakeResult(object):
+    def __init__(self, ok):
+        self.ok = ok
+
+    def successful(self):
+        return self.ok
+
+
+class FakeData(object):
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.uploaded = []
+
+    def upload(self, dataset_id, source_path, dest_path=None):
+        if self.failures.get(dest_path, 0):
+            self.failures[dest_path] -= 1
+            raise IOError('timed out')
+        with open(source_path) as f:
+            json.load(f)
+        self.uploaded.append(dest_path)
+        return FakeResult(True)
+
+
+class FakeClient(object):
+    def __init__(self, failures=()):
+        self.data = FakeData(failures)
+
+
+def test_write_pif_shards_bounds_size(tmp_path):
+    manifest = UploadManifest(str(tmp_path / 'manifest.json'))
+    shards = write_pif_shards(['BaO', 'TiO2', 'SrO', 'ZrO2'], manifest, max_bytes=80)
+    assert len(shards) > 1
+    systems = []
+    for shard in shards:
+        assert shard['bytes'] <= 80
+        with open(str(tmp_path / shard['path'])) as f:
+            systems += [system['chemicalFormula'] for system in json.load(f)]
+    assert systems == ['BaO', 'TiO2', 'SrO', 'ZrO2']
+
+
+def test_upload_retries_and_resumes(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = UploadManifest(path)
+    manifest.dataset_id = 1
+    write_pif_shards(['BaO', 'TiO2', 'SrO'], manifest, max_bytes=1)
+    client = FakeClient({'pifs-00000.json': 1, 'pifs-00001.json': 5})
+    with pytest.raises(RuntimeError):
+        upload_shards(client, 1, manifest, workers=2, retries=2, backoff=0)
+    assert sorted(client.data.uploaded) == ['pifs-00000.json', 'pifs-00002.json']
+
+    resumed = UploadManifest(path)
+    assert [shard['path'] for shard in resumed.pending] == ['pifs-00001.json']
+    client = FakeClient()
+    assert upload_shards(client, resumed.dataset_id, resumed, backoff=0) == 1
+    assert client.data.uploaded == ['pifs-00001.json']
+    assert not UploadManifest(path).pending
+
+
+def test_write_pif_shards_saves_each_shard(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = UploadManifest(path)
+
+    def crash():
+        yield 'BaO'
+        yield 'TiO2'
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        write_pif_shards(crash(), manifest, max_bytes=1)
+    interrupted = UploadManifest(path)
+    assert [shard['path'] for shard in interrupted.shards] == ['pifs-00000.json', 'pifs-00001.json']
+    assert not interrupted.written
+    assert not interrupted.resumable
+
+
+def test_manifest_resumes_only_matching_unfinished_upload(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = UploadManifest(path)
+    manifest.reset({'dataset_id': '1'})
+    manifest.dataset_id = 1
+    write_pif_shards(['BaO', 'TiO2'], manifest, max_bytes=1)
+    assert manifest.digest == data_digest(['BaO', 'TiO2'])
+    assert UploadManifest(path).resumable
+
+    upload_shards(FakeClient(), 1, manifest, backoff=0)
+    manifest.mark_done()
+    assert not UploadManifest(path).resumable
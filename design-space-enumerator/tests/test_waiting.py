@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from design_space_enumerator.waiting import *
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeData(object):
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def get_ingest_status(self, dataset_id):
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+
+class FakeClient(object):
+    def __init__(self, statuses):
+        self.data = FakeData(statuses)
+
+
+def make_waiter(clock, **kwargs):
+    return Waiter(sleep=clock.sleep, clock=clock, rng=lambda: 0.5, **kwargs)
+
+
+def test_wait_backs_off_exponentially():
+    clock = FakeClock()
+    waiter = make_waiter(clock, initial=1, maximum=4, timeout=None)
+    client = FakeClient(['Processing'] * 5 + ['Finished'])
+    assert wait_for_ingest(client, 1, waiter) == 'Finished'
+    assert clock.sleeps == [1, 2, 4, 4, 4]
+    assert waiter.polls == 6
+    assert waiter.latency == 15
+
+
+def test_wait_returns_without_sleeping_when_done():
+    clock = FakeClock()
+    waiter = make_waiter(clock)
+    assert wait_for_ingest(FakeClient(['Finished']), 1, waiter) == 'Finished'
+    assert clock.sleeps == []
+    assert waiter.polls == 1
+
+
+def test_wait_times_out():
+    clock = FakeClock()
+    waiter = make_waiter(clock, initial=1, timeout=10)
+    with pytest.raises(TimeoutError):
+        wait_for_ingest(FakeClient(['Processing']), 1, waiter)
+    assert clock.now == 10
+    assert waiter.total_polls == waiter.polls
+
+
+def test_wait_raises_on_failed_ingest():
+    clock = FakeClock()
+    with pytest.raises(RuntimeError):
+        wait_for_ingest(FakeClient(['Processing', 'Failed']), 1, make_waiter(clock))
+
+
+def test_wait_can_be_cancelled():
+    clock = FakeClock()
+    waiter = make_waiter(clock, cancelled=lambda: clock.now > 2)
+    with pytest.raises(WaitCancelled):
+        waiter.wait(lambda: None)
+    assert waiter.polls == 3
+
+
+def test_wait_jitter_spreads_pauses():
+    clock = FakeClock()
+    waiter = Waiter(initial=1, jitter=0.5, timeout=None, sleep=clock.sleep, clock=clock, rng=lambda: 0.0)
+    waiter.wait(iter([False, True]).__next__)
+    assert clock.sleeps == [0.5]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import pandas as pd
+import pytest
+from design_space_enumerator.writers import *
+
+__author__ = "malcolm@davidsonnanosolutions.com"
+__copyright__ = "malcolm@davidsonnanosolutions.com"
+__license__ = "mit"
+
+
+def test_chunked_writer_appends_chunks(tmp_path):
+    filepath = str(tmp_path / 'design_space.csv')
+    writer = ChunkedCSVWriter(filepath, chunksize=2)
+    writer.write(['BaO', 'TiO2', 'SrO'])
+    assert writer.rows == 2
+    writer.close()
+    assert writer.rows == 3
+    with open(filepath) as f:
+        assert f.read().split() == ['Chemical', 'Formula', 'BaO', 'TiO2', 'SrO']
+
+
+def test_chunked_writer_matches_pandas_csv(tmp_path):
+    filepath = str(tmp_path / 'design_space.csv')
+    with ChunkedCSVWriter(filepath, chunksize=2) as writer:
+        writer.write(['BaO', 'TiO2', 'SrO'])
+    expected = pd.DataFrame(data=['BaO', 'TiO2', 'SrO'], columns=[FORMULA_COLUMN]).to_csv(index=False)
+    with open(filepath, 'rb') as f:
+        assert f.read() == expected.encode()
+
+
+def test_chunked_writer_gzip(tmp_path):
+    filepath = str(tmp_path / 'design_space.csv.gz')
+    with ChunkedCSVWriter(filepath) as writer:
+        writer.write(['BaO'])
+    assert writer.compression == 'gzip'
+    with gzip.open(filepath, 'rt') as f:
+        assert f.read().splitlines() == ['Chemical Formula', 'BaO']
+
+
+def test_element_amounts_expands_groups():
+    assert element_amounts('Ba(TiO3)2') == {'Ba': 1.0, 'Ti': 2.0, 'O': 6.0}
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow', 'feather'])
+def test_columnar_writer(tmp_path, output_format):
+    pa = pytest.importorskip('pyarrow')
+    filepath = str(tmp_path / 'design_space.{}'.format(output_format))
+    with open_writer(filepath, output_format, chunksize=1, elements=['Ba', 'Ti', 'O']) as writer:
+        writer.write(['BaTiO3', 'TiO2'])
+    if output_format == 'parquet':
+        table = pa.parquet.read_table(filepath)
+    else:
+        table = pa.ipc.open_file(pa.memory_map(filepath)).read_all()
+    assert table.column(FORMULA_COLUMN).to_pylist() == ['BaTiO3', 'TiO2']
+    assert table.column(COUNT_COLUMN).to_pylist() == [3, 2]
+    assert table.column(fraction_column('O')).to_pylist() == [0.6, pytest.approx(2 / 3)]
+    assert table.column(fraction_column('Ba')).to_pylist() == [0.2, 0.0]
+
+
+def test_chunked_writer_requires_hooks(tmp_path):
+    class PartialWriter(ChunkedWriter):
+        def _close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialWriter(str(tmp_path / 'design_space.txt'))
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_columnar_writer_without_palette(tmp_path, output_format):
+    pa = pytest.importorskip('pyarrow')
+    filepath = str(tmp_path / 'design_space.{}'.format(output_format))
+    with open_writer(filepath, output_format, chunksize=2) as writer:
+        writer.write(['BaTiO3', 'TiO2', 'BaO'])
+    if output_format == 'parquet':
+        table = pa.parquet.read_table(filepath)
+    else:
+        table = pa.ipc.open_file(pa.memory_map(filepath)).read_all()
+    assert writer.elements == ['Ba', 'Ti', 'O']
+    assert table.column(fraction_column('Ba')).to_pylist() == [0.2, 0.0, 0.5]
+
+
+def test_columnar_writer_rejects_element_outside_palette(tmp_path):
+    pytest.importorskip('pyarrow')
+    with pytest.raises(ValueError, match='SrO has element Sr'):
+        with open_writer(str(tmp_path / 'design_space.parquet'), 'parquet', chunksize=1, elements=['Ba', 'O']) as writer:
+            writer.write(['BaO', 'SrO'])
+    assert not writer._writer.is_open
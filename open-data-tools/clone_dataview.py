@@ -1,4 +1,10 @@
 #### standard packages ####
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
 
 #### third party libraries ####
@@ -6,17 +12,11 @@ from citrination_client import CitrinationClient
 from citrination_client.views.data_view_builder import DataViewBuilder
 
 
-#### Set up a citrination client
-client = CitrinationClient(
-    environ.get("CITRINATION_API_KEY"),
-    "https://citrination.com"
-)
-
-#### Initialize the client
+#### Data view cloned when no IDs are given
 data_view_id = '117'
 
 
-def clone_data_view(client, target):
+def clone_data_view(client, target, dataset_ids=None):
     """
     Creates a dataview if one does not exist at the supplied ID
 
@@ -24,15 +24,19 @@ def clone_data_view(client, target):
     :type: CitrinationClient
     :param: target: metadata of the dataview to be copied
     :type: dict
+    :param: dataset_ids: datasets of the copy, the target's datasets if None
+    :type: list
     :return: view_id: the view id of the created id
     :type: str
     """
 
     # Create ML configuration
     dv_builder = DataViewBuilder()
-    dv_builder.dataset_ids(target['configuration']['dataset_ids'])
-    [dv_builder.set_role(key, role.lower()) for key, role in target['configuration']['roles'].items()]
-    [dv_builder.add_raw_descriptor(descriptor) for descriptor in target['configuration']['descriptors']]
+    dv_builder.dataset_ids(dataset_ids or target['configuration']['dataset_ids'])
+    for key, role in target['configuration']['roles'].items():
+        dv_builder.set_role(key, role.lower())
+    for descriptor in target['configuration']['descriptors']:
+        dv_builder.add_raw_descriptor(descriptor)
     dv_config = dv_builder.build()
 
     view_id = client.data_views.create(dv_config,
@@ -42,7 +46,232 @@ def clone_data_view(client, target):
 
     return view_id
 
-if __name__ == "__main__":
-    target_dv = client.data_views.get(data_view_id)
-    print('Dataview at ID {} cloned to ID {}'.format(data_view_id, clone_data_view(client, target_dv)))
 
+def read_manifest(path):
+    """
+    Reads the view IDs of a manifest, one per line or as a JSON list
+
+    A manifest holding a single ID is read as a list of that ID.
+
+    :param: path: the manifest file
+    :type: str
+    :return: the view IDs, without duplicates
+    :type: list
+    """
+    with open(path) as f:
+        text = f.read()
+    try:
+        view_ids = json.loads(text)
+    except ValueError:
+        view_ids = [line.split('#')[0].strip() for line in text.splitlines()]
+    if isinstance(view_ids, (int, str)) and not isinstance(view_ids, bool):
+        view_ids = [view_ids]
+    elif not isinstance(view_ids, list):
+        raise ValueError('Manifest {} must hold a JSON list of view IDs or one ID per line'.format(path))
+    return list(dict.fromkeys(str(view_id) for view_id in view_ids if str(view_id)))
+
+
+class CloneMapping(object):
+    """
+    Old to new view ID mapping, saved after every clone so a migration can resume
+
+    :param: path: the JSON mapping file, loaded if it exists
+    :type: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.views = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.views = json.load(f)
+
+    def record(self, old_id, new_id):
+        with self._lock:
+            self.views[str(old_id)] = str(new_id)
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(self.views, f, indent=2, sort_keys=True)
+            os.replace(temporary, self.path)
+
+
+class DatasetResolver(object):
+    """
+    Resolves the datasets of the cloned views, looking each shared dataset up only once
+
+    :param: client: a citrination client object
+    :type: CitrinationClient
+    :param: dataset_map: old to new dataset IDs of a migration
+    :type: dict
+    """
+
+    def __init__(self, client, dataset_map=None):
+        self.client = client
+        self.dataset_map = {str(old): str(new) for old, new in (dataset_map or {}).items()}
+        self.resolved = {}
+
+    def resolve_all(self, targets, workers=4):
+        """
+        Checks every distinct dataset of the targets before any view is created
+
+        :param: targets: metadata of the dataviews to be copied
+        :type: list
+        :return: the datasets that could not be found, with their errors
+        :type: dict
+        """
+        dataset_ids = list(dict.fromkeys(str(dataset_id) for target in targets
+                                         for dataset_id in target['configuration']['dataset_ids']))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self._resolve, dataset_ids))
+        return {dataset_id: error for dataset_id, error in zip(dataset_ids, results) if error}
+
+    def _resolve(self, dataset_id):
+        new_id = self.dataset_map.get(dataset_id, dataset_id)
+        try:
+            self.client.data.get_dataset(new_id)
+        except Exception as exc:
+            return exc
+        self.resolved[dataset_id] = new_id
+        return None
+
+    def dataset_ids(self, target):
+        return [self.resolved[str(dataset_id)] for dataset_id in target['configuration']['dataset_ids']]
+
+
+def clone_data_views(client, view_ids, mapping, dataset_map=None, workers=4):
+    """
+    Clones many dataviews through a bounded worker pool, skipping views already in the mapping
+
+    :param: client: a citrination client object
+    :type: CitrinationClient
+    :param: view_ids: the view IDs to clone
+    :type: list
+    :param: mapping: the old to new view ID mapping, updated as views are created
+    :type: CloneMapping
+    :param: dataset_map: old to new dataset IDs of a migration
+    :type: dict
+    :param: workers: the number of concurrent requests
+    :type: int
+    :return: failed: the view IDs that could not be cloned, with their errors
+    :type: dict
+    """
+    pending = [str(view_id) for view_id in view_ids if str(view_id) not in mapping.views]
+    failed = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(zip(pending, executor.map(_fetch, [client] * len(pending), pending)))
+    targets = {}
+    for view_id, (target, error) in fetched:
+        if error is None:
+            targets[view_id] = target
+        else:
+            failed[view_id] = error
+
+    # Datasets shared by several views are resolved once, before any view is created
+    resolver = DatasetResolver(client, dataset_map)
+    missing = resolver.resolve_all(targets.values(), workers)
+    for view_id, target in list(targets.items()):
+        absent = [str(d) for d in target['configuration']['dataset_ids'] if str(d) in missing]
+        if absent:
+            failed[view_id] = 'missing datasets {}'.format(', '.join(absent))
+            del targets[view_id]
+
+    def clone(view_id):
+        new_id = clone_data_view(client, targets[view_id], resolver.dataset_ids(targets[view_id]))
+        mapping.record(view_id, new_id)
+        print('Dataview at ID {} cloned to ID {}'.format(view_id, new_id))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {view_id: executor.submit(clone, view_id) for view_id in targets}
+    for view_id, future in futures.items():
+        if future.exception() is not None:
+            failed[view_id] = future.exception()
+    return failed
+
+
+def _fetch(client, view_id):
+    try:
+        return client.data_views.get(view_id), None
+    except Exception as exc:
+        return None, exc
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Clone Citrination data views, resuming from an old to new ID mapping.")
+    parser.add_argument(
+        'view_ids',
+        help="data view IDs to clone",
+        nargs='*',
+        type=str)
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        dest="manifest",
+        help="file listing data view IDs to clone, one per line or as a JSON list",
+        default=None,
+        type=str)
+    parser.add_argument(
+        '-o',
+        '--mapping',
+        dest="mapping",
+        help="JSON old to new view ID mapping; views already in it are skipped",
+        default='cloned_views.json',
+        type=str)
+    parser.add_argument(
+        '-d',
+        '--dataset-map',
+        dest="dataset_map",
+        help="JSON old to new dataset ID mapping applied to the clones",
+        default=None,
+        type=str)
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest="workers",
+        help="number of concurrent requests",
+        default=4,
+        type=int)
+    parser.add_argument(
+        '-k',
+        '--apikey',
+        dest="api_string",
+        help="Citrination API key environment variable name",
+        default="CITRINATION_API_KEY",
+        type=str)
+    parser.add_argument(
+        '-s',
+        '--site',
+        dest="site",
+        help="Citrination site url",
+        default="https://citrination.com",
+        type=str)
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    #### Set up a citrination client
+    client = CitrinationClient(environ.get(args.api_string), args.site)
+
+    view_ids = list(args.view_ids)
+    if args.manifest:
+        view_ids += read_manifest(args.manifest)
+    view_ids = list(dict.fromkeys(view_ids or [data_view_id]))
+
+    dataset_map = None
+    if args.dataset_map:
+        with open(args.dataset_map) as f:
+            dataset_map = json.load(f)
+
+    mapping = CloneMapping(args.mapping)
+    failed = clone_data_views(client, view_ids, mapping, dataset_map, args.workers)
+    for view_id, error in failed.items():
+        print('-- Could not clone data view {}: {} --'.format(view_id, error), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
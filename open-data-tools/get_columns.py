@@ -1,84 +1,139 @@
 #### standard packages ####
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
-from time import sleep
 
 #### third party libraries ####
-from citrination_client import CitrinationClient
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from citrination_client.base.response_handling import check_for_rate_limiting
+from citrination_client.models.client import ModelsClient
 
-#### Set up a citrination client
-client = CitrinationClient(
-    environ.get("CITRINATION_API_KEY"),
-    "https://citrination.com"
-)
+#### descriptor fields exported for every column
+COMMON_FIELDS = ('name', 'role', 'group_by_key', 'column_type', 'units')
 
-#### Initialize the client
-dataset_id = 111
-data_view_id = 97
-model_client = client.models
+#### descriptor fields that only exist on some column types
+TYPE_FIELDS = {
+    'Real': ('lower_bound', 'upper_bound'),
+    'Integer': ('lower_bound', 'upper_bound'),
+    'Categorical': ('categories',),
+    'Vector': ('length',),
+    'Alloy composition': ('balance_element', 'basis'),
+    'Inorganic': (),
+    'Organic': (),
+    'Formulation': (),
+}
 
+cols = ['view_id', 'name', 'role', 'group_by_key', 'column_type', 'categories', 'units',
+        'lower_bound', 'upper_bound', 'length', 'balance_element', 'basis']
 
-view = model_client.get_data_view(data_view_id)
 
-# get name
-# get role
-# get type
-# get lower
-# get upper
-descriptor_list = []
+class SessionModelsClient(ModelsClient):
+    """
+    Models client that sends its GET requests over one pooled keep-alive session
+    """
 
-for column in view.columns:
-    name, role, group_by_key, column_type, categories, units, lower_bound, upper_bound, length, balance_element, basis = [None for i in range(0, 11)]
+    def __init__(self, api_key, site, pool_size=8):
+        super().__init__(api_key, site)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
-    name = column.name
-    role = column.role
-    group_by_key = column.group_by_key
+    def _get(self, route, headers=None, failure_message=None):
+        headers = self._get_headers(headers)
+        response_lambda = lambda: self.session.get(
+            self._get_qualified_route(route), headers=headers, verify=False, proxies=self.proxies)
+        response = check_for_rate_limiting(response_lambda(), response_lambda)
+        return self._handle_response(response, failure_message)
+
+
+def describe_column(view_id, column):
+    """
+    Extracts the descriptor fields of one data view column by its type's schema
+    """
     column_type = column._type
+    descriptor = dict.fromkeys(cols)
+    descriptor['view_id'] = view_id
+    descriptor['column_type'] = column_type
+    for field in COMMON_FIELDS + TYPE_FIELDS.get(column_type, ()):
+        if field != 'column_type':
+            descriptor[field] = getattr(column, field)
+    return descriptor
+
+
+def describe_view(model_client, view_id):
+    """
+    Fetches a data view and returns one descriptor row per column
+    """
+    view = model_client.get_data_view(view_id)
+    return [describe_column(view_id, column) for column in view.columns]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Export the column descriptors of Citrination data views to one csv.")
+    parser.add_argument(
+        'view_ids',
+        help="data view IDs to export",
+        nargs='*',
+        default=[97],
+        type=int)
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest="output",
+        help="csv file the descriptors are written to",
+        default='descriptors.csv',
+        type=str)
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest="workers",
+        help="number of data views fetched concurrently",
+        default=8,
+        type=int)
+    parser.add_argument(
+        '-k',
+        '--apikey',
+        dest="api_string",
+        help="Citrination API key environment variable name",
+        default="CITRINATION_API_KEY",
+        type=str)
+    parser.add_argument(
+        '-s',
+        '--site',
+        dest="site",
+        help="Citrination site url",
+        default="https://citrination.com",
+        type=str)
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    #### Set up a pooled citrination models client
+    model_client = SessionModelsClient(environ.get(args.api_string), args.site, pool_size=args.workers)
+
+    descriptor_list = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(describe_view, model_client, view_id) for view_id in args.view_ids]
+        for view_id, future in zip(args.view_ids, futures):
+            try:
+                descriptor_list.extend(future.result())
+            except Exception as exc:
+                print('-- Could not export data view {}: {} --'.format(view_id, exc), file=sys.stderr)
+                failed.append(view_id)
+
+    pd.DataFrame(descriptor_list, columns=cols).to_csv(args.output, index=False)
+    print('Exported {} columns of {} data views to {}'.format(
+        len(descriptor_list), len(args.view_ids) - len(failed), args.output))
+    return 1 if failed else 0
+
 
-    try:
-        categories = column.categories
-    except:
-        pass
-    try:
-        units = column.units
-    except:
-        pass
-    try:
-        lower_bound = column.lower_bound
-    except:
-        pass
-    try:
-        upper_bound = column.upper_bound
-    except:
-        pass
-    try:
-        length = column.length
-    except:
-        pass
-    try:
-        balance_element = column.balance_element
-    except:
-        pass
-    try:
-        basis = column.basis
-    except:
-        pass
-
-    descriptor = [name,
-                  role,
-                  group_by_key,
-                  column_type,
-                  categories,
-                  units,
-                  lower_bound,
-                  upper_bound,
-                  length,
-                  balance_element,
-                  basis]
-
-    descriptor_list.append(descriptor)
-
-cols = ['name','role','group_by_key','column_type','categories','units',
-           'lower_bound','upper_bound','length','balance_element','basis']
-
-descriptor_df = pd.DataFrame(descriptor_list).to_csv('descriptors.csv', header=cols, index=False)
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
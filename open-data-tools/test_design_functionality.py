@@ -1,50 +1,274 @@
 #### standard packages ####
+import argparse
+import heapq
+import itertools
+import sys
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
-from time import sleep
+from time import monotonic, sleep
 
 #### third party libraries ####
+import numpy as np
 from citrination_client import CitrinationClient
 from citrination_client.models.design import Target
-from citrination_client.models.design.constraints import *
-
-#### Set up a citrination client
-client = CitrinationClient(
-    environ.get("CITRINATION_API_KEY"),
-    "https://citrination.com"
-)
-
-#### Initialize the client
-dataset_id = 111
-data_view_id = 97
-model_client = client.models
-
-#### Submit a design request
-design_uuid = model_client.submit_design_run(data_view_id ,
-                                             num_candidates = 20,
-                                             effort = 10,
-                                             target=Target('Property r0_sphere', 10),
-                                             constraints=[],
-                                             sampler="Default"
-                                             ).uuid
-
-#### Wait for design to finish
-fin = False
-
-while not fin:
-
-    stat = model_client.get_design_run_status(data_view_id, design_uuid)
-    sleep(10)
-    print('design finished: {} ({}/100)'.format(stat.finished(), stat.progress))
-
-    if int(stat.progress) == 100:
-        fin = True
-
-results = model_client.get_design_run_results(data_view_id, design_uuid)
-
-#### Print results
-for i, result in enumerate(results.best_materials):
-    print('Result {}\n{}\n'.format(i,result))
-# for item in result:
-# print(item)
-# print(result['descriptor_values']['Uncertainty in Property pop1_specie0_r0'])
-# print(result['citrine_score'])
+
+#### One cell of the design run matrix
+DesignConfig = namedtuple('DesignConfig', 'view_id, target, effort, num_candidates')
+
+
+class DesignRun(object):
+    """
+    A submitted design run and its polling state
+    """
+
+    def __init__(self, config, uuid, submitted, interval):
+        self.config = config
+        self.uuid = uuid
+        self.submitted = submitted
+        self.interval = interval
+        self.latency = None
+        self.error = None
+        self.progress = 0
+
+
+def parse_target(spec):
+    """
+    Parses a '<column>=<objective>' target, e.g. 'Property r0_sphere=10' or 'Property band gap=Max'
+    """
+    name, separator, objective = spec.rpartition('=')
+    if not (separator and name.strip() and objective.strip()):
+        raise argparse.ArgumentTypeError("target must look like '<column>=<objective>', got {!r}".format(spec))
+    return name, objective
+
+
+def design_matrix(view_ids, targets, efforts, num_candidates, repeats=1):
+    """
+    Expands the run parameters into one config per combination, repeated
+    """
+    configs = [DesignConfig(*cell) for cell in itertools.product(view_ids, targets, efforts, num_candidates)]
+    return [config for config in configs for _ in range(repeats)]
+
+
+def submit(model_client, config, clock=monotonic):
+    """
+    Submits one design run and returns its uuid and the time it was submitted at
+    """
+    name, objective = config.target
+    submitted = clock()
+    uuid = model_client.submit_design_run(config.view_id,
+                                          num_candidates=config.num_candidates,
+                                          effort=config.effort,
+                                          target=Target(name, objective),
+                                          constraints=[],
+                                          sampler="Default"
+                                          ).uuid
+    return uuid, submitted
+
+
+def run_farm(model_client, configs, workers=8, poll_interval=1.0, max_interval=10.0, backoff=1.5,
+             timeout=1800, clock=monotonic, sleep=sleep):
+    """
+    Submits design runs concurrently and polls all of them from one scheduler
+
+    Each run is polled as soon as it is submitted and then on its own
+    backing-off interval, so quick runs are noticed quickly and slow runs
+    do not flood the API. Runs due at the same time are polled together.
+    A failed status check is retried on the run's schedule until the
+    timeout, and only then recorded as the run's error.
+    """
+    runs = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        #### Submit every design run
+        submitted = [(config, executor.submit(submit, model_client, config, clock)) for config in configs]
+        for config, future in submitted:
+            run = DesignRun(config, None, None, poll_interval)
+            try:
+                run.uuid, run.submitted = future.result()
+            except Exception as exc:
+                run.error = exc
+            runs.append(run)
+
+        #### Poll the runs in the order they are due
+        queue = [(run.submitted, i) for i, run in enumerate(runs) if run.error is None]
+        heapq.heapify(queue)
+        while queue:
+            delay = queue[0][0] - clock()
+            if delay > 0:
+                sleep(delay)
+            now = clock()
+            due = []
+            while queue and queue[0][0] <= now:
+                due.append(heapq.heappop(queue)[1])
+
+            statuses = [executor.submit(model_client.get_design_run_status, run.config.view_id, run.uuid)
+                        for run in (runs[i] for i in due)]
+            for i, future in zip(due, statuses):
+                run = runs[i]
+                now = clock()
+                try:
+                    stat = future.result()
+                except Exception as exc:
+                    #### Transient failures are retried until the run times out
+                    if now - run.submitted > timeout:
+                        run.error = exc
+                    else:
+                        heapq.heappush(queue, (now + run.interval, i))
+                        run.interval = min(run.interval * backoff, max_interval)
+                    continue
+                run.progress = int(stat.progress)
+                if stat.finished() or run.progress == 100:
+                    run.latency = now - run.submitted
+                elif stat.killed():
+                    run.error = 'design run killed'
+                elif now - run.submitted > timeout:
+                    run.error = 'timed out after {} s'.format(timeout)
+                else:
+                    heapq.heappush(queue, (now + run.interval, i))
+                    run.interval = min(run.interval * backoff, max_interval)
+    return runs
+
+
+def latency_report(runs):
+    """
+    Summarizes the latency of the finished runs of each configuration
+    """
+    groups = OrderedDict()
+    for run in runs:
+        groups.setdefault(run.config, []).append(run)
+
+    report = []
+    for config, group in groups.items():
+        latencies = [run.latency for run in group if run.latency is not None]
+        row = OrderedDict([
+            ('view_id', config.view_id),
+            ('target', '{}={}'.format(*config.target)),
+            ('effort', config.effort),
+            ('num_candidates', config.num_candidates),
+            ('runs', len(group)),
+            ('failed', len(group) - len(latencies)),
+            ('p50', np.percentile(latencies, 50) if latencies else float('nan')),
+            ('p95', np.percentile(latencies, 95) if latencies else float('nan')),
+        ])
+        report.append(row)
+    return report
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Smoke test Citrination design runs over a matrix of views, targets, efforts and candidates.")
+    parser.add_argument(
+        '-v',
+        '--views',
+        dest="view_ids",
+        help="data view IDs",
+        nargs='+',
+        default=[97],
+        type=int)
+    parser.add_argument(
+        '-t',
+        '--targets',
+        dest="targets",
+        help="targets as '<column>=<objective>'",
+        nargs='+',
+        default=['Property r0_sphere=10'],
+        type=parse_target)
+    parser.add_argument(
+        '-e',
+        '--efforts',
+        dest="efforts",
+        help="design efforts",
+        nargs='+',
+        default=[10],
+        type=int)
+    parser.add_argument(
+        '-n',
+        '--num-candidates',
+        dest="num_candidates",
+        help="numbers of candidates",
+        nargs='+',
+        default=[20],
+        type=int)
+    parser.add_argument(
+        '-r',
+        '--repeats',
+        dest="repeats",
+        help="design runs per configuration",
+        default=1,
+        type=int)
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest="workers",
+        help="number of concurrent requests",
+        default=8,
+        type=int)
+    parser.add_argument(
+        '-pi',
+        '--poll-interval',
+        dest="poll_interval",
+        help="seconds between the first status checks of a run, backing off to 10",
+        default=1.0,
+        type=float)
+    parser.add_argument(
+        '-to',
+        '--timeout',
+        dest="timeout",
+        help="seconds before a design run is given up on",
+        default=1800,
+        type=float)
+    parser.add_argument(
+        '-p',
+        '--print-results',
+        dest="print_results",
+        help="print the best materials of every finished run",
+        action='store_true')
+    parser.add_argument(
+        '-k',
+        '--apikey',
+        dest="api_string",
+        help="Citrination API key environment variable name",
+        default="CITRINATION_API_KEY",
+        type=str)
+    parser.add_argument(
+        '-s',
+        '--site',
+        dest="site",
+        help="Citrination site url",
+        default="https://citrination.com",
+        type=str)
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    #### Set up a citrination client
+    client = CitrinationClient(environ.get(args.api_string), args.site)
+    model_client = client.models
+
+    configs = design_matrix(args.view_ids, args.targets, args.efforts, args.num_candidates, args.repeats)
+    runs = run_farm(model_client, configs, workers=args.workers, poll_interval=args.poll_interval,
+                    timeout=args.timeout)
+
+    for run in runs:
+        if run.error is not None:
+            print('-- Design run {} on view {} failed: {} --'.format(
+                run.uuid, run.config.view_id, run.error), file=sys.stderr)
+        elif args.print_results:
+            results = model_client.get_design_run_results(run.config.view_id, run.uuid)
+            for i, result in enumerate(results.best_materials):
+                print('Result {}\n{}\n'.format(i, result))
+
+    #### Print latencies
+    print('{:>8} {:>30} {:>6} {:>10} {:>4} {:>6} {:>8} {:>8}'.format(
+        'view', 'target', 'effort', 'candidates', 'runs', 'failed', 'p50 (s)', 'p95 (s)'))
+    for row in latency_report(runs):
+        print('{view_id:>8} {target:>30} {effort:>6} {num_candidates:>10} {runs:>4} {failed:>6} '
+              '{p50:>8.1f} {p95:>8.1f}'.format(**row))
+    return 1 if any(run.error is not None for run in runs) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))